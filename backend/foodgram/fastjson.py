@@ -0,0 +1,65 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PARSE_ERROR = 'JSON parse error - {}'
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson, без него - стандартный json.
+
+    Результат совпадает с JSONRenderer: компактный UTF-8, типы вне JSON
+    (Decimal, даты, UUID, QuerySet) приводятся его JSONEncoder. С
+    отступами и настройками DRF, которых нет в orjson, рендерит
+    стандартный json.
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact or self.get_indent(
+                    accepted_media_type, renderer_context or {}) is not None):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        try:
+            # Даты идут через JSONEncoder DRF: формат как у JSONRenderer.
+            content = orjson.dumps(
+                data, default=self.encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # Например, целые больше 64 бит.
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        # Как JSONRenderer, экранирует разделители строк для JavaScript.
+        return content.replace(LINE_SEPARATOR, b'\\u2028').replace(
+            PARAGRAPH_SEPARATOR, b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser на orjson, без него - стандартный json.
+
+    Тело читается одной строкой байт и разбирается без промежуточной
+    декодированной строки, поэтому большая картинка в base64 копируется
+    в памяти только в итоговую строку поля.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get(
+            'encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError(PARSE_ERROR.format(error))
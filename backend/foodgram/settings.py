@@ -21,15 +21,18 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
     'djoser',
     'users.apps.UsersConfig',
     'recipes.apps.RecipesConfig',
+    'metrics.apps.MetricsConfig',
 ]
 
 MIDDLEWARE = [
+    'metrics.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,6 +73,32 @@ DATABASES = {
     }
 }
 
+RESPONSE_CACHES = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv(
+            'RESPONSE_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': RESPONSE_CACHES[os.getenv('RESPONSE_CACHE_BACKEND', 'file')],
+}
+
+RECIPES_CACHE = 'responses'
+RECIPES_CACHE_TIMEOUT = 300
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -85,14 +114,46 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Рендерер и парсер JSON: на orjson, если он установлен, или из DRF.
+JSON_CLASSES = {
+    'fast': ('foodgram.fastjson.FastJSONRenderer',
+             'foodgram.fastjson.FastJSONParser'),
+    'stdlib': ('rest_framework.renderers.JSONRenderer',
+               'rest_framework.parsers.JSONParser'),
+}
+JSON_RENDERER, JSON_PARSER = JSON_CLASSES[os.getenv('API_JSON', 'fast')]
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        JSON_RENDERER,
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        JSON_PARSER,
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_PAGINATION_CLASS': 'users.pagination.QueryPageSizePagination',
     'SEARCH_PARAM': 'name'
 }
 
+# Кеш токенов: размер LRU и время жизни записи в процессе в секундах.
+# TOKEN_CACHE_BACKEND - алиас общего кеша, например responses с Redis.
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 30))
+TOKEN_CACHE_BACKEND = os.getenv('TOKEN_CACHE_BACKEND') or None
+
+# Замеры запросов по view.action: /api/metrics/ и slowest_endpoints.
+# METRICS_N_PLUS_ONE - сколько раз один SQL может повториться за запрос.
+# METRICS_TOKEN открывает /api/metrics/ по Bearer-токену, без него
+# метрики видят только администраторы.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+METRICS_N_PLUS_ONE = int(os.getenv('METRICS_N_PLUS_ONE', 10))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
 }
@@ -112,3 +173,34 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.getenv('RECIPE_IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+RECIPE_IMAGE_QUALITY = 85
+RECIPE_IMAGE_GC_GRACE = int(os.getenv('RECIPE_IMAGE_GC_GRACE', 60 * 60))
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (300, 300),
+    'card': (640, 640),
+    'full': (1600, 1600),
+}
+
+# list, retrieve и feed рецептов через RecipeReader из values().
+RECIPE_FAST_READ = os.getenv('RECIPE_FAST_READ', 'true').lower() == 'true'
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+# PDF строится в памяти, больше строк отдаётся только txt, csv и json.
+SHOPPING_CART_PDF_MAX_ROWS = int(
+    os.getenv('SHOPPING_CART_PDF_MAX_ROWS', 5000))
+
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'auto')
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_MAX_LIMIT = 100
+
+REFERENCE_CACHE_SIZE = 512
+REFERENCE_CACHE_MAX_AGE = 0
+
+FEED_STRATEGY = os.getenv('FEED_STRATEGY', 'read')
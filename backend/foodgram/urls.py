@@ -4,5 +4,6 @@ from django.urls import include, path
 urlpatterns = [
     path('api/', include('users.urls')),
     path('api/', include('recipes.urls')),
+    path('api/', include('metrics.urls')),
     path('admin/', admin.site.urls),
 ]
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from metrics import registry
+
+HEADER = '{:<36} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>5}'
+ROW = ('{:<36} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} '
+       '{:>5}')
+NO_DATA = 'Замеров нет, включите METRICS_ENABLED'
+REPEATED = 'Повтор SQL в {}: {}'
+RESET = 'Статистика сброшена'
+
+
+def summary(endpoint, stats):
+    count = stats['count']
+    return {
+        'endpoint': endpoint,
+        'count': count,
+        'mean': stats['duration'] / count * 1000,
+        'p95': registry.percentile(stats, 95) * 1000,
+        'p99': registry.percentile(stats, 99) * 1000,
+        'queries': stats['queries'] / count,
+        'sql': stats['sql'] / count * 1000,
+        'serializer': stats['serializer'] / count * 1000,
+        'n_plus_one': stats['n_plus_one'],
+        'example': stats['example'],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Самые медленные view.action по замерам MetricsMiddleware во '
+            'всех процессах: время в мс, запросы и время SQL на ответ')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument(
+            '--sort', default='p95',
+            choices=('p95', 'p99', 'mean', 'queries', 'sql', 'n_plus_one'))
+        parser.add_argument('--reset', action='store_true',
+                            help='Сбросить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            registry.reset()
+            self.stdout.write(RESET)
+            return
+        rows = sorted(
+            (summary(endpoint, stats)
+             for endpoint, stats in registry.collect().items()),
+            key=lambda row: row[options['sort']],
+            reverse=True)[:options['limit']]
+        if not rows:
+            self.stdout.write(NO_DATA)
+            return
+        self.stdout.write(HEADER.format(
+            'view.action', 'n', 'mean', 'p95', 'p99', 'запросы', 'sql',
+            'serial.', 'N+1'))
+        for row in rows:
+            self.stdout.write(ROW.format(
+                row['endpoint'], row['count'], row['mean'], row['p95'],
+                row['p99'], row['queries'], row['sql'], row['serializer'],
+                row['n_plus_one']))
+        for row in rows:
+            if row['example']:
+                self.stdout.write(REPEATED.format(
+                    row['endpoint'], row['example']))
@@ -0,0 +1,113 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import registry
+
+UNRESOLVED = 'unresolved'
+N_PLUS_ONE = 'Повтор SQL в %s: %s раз %s'
+# Списки параметров IN и числа в LIMIT не меняют вид запроса.
+PARAMETERS = re.compile(r'%s(?:\s*,\s*%s)+|\b\d+\b')
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class Measurement:
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0
+        self.shapes = Counter()
+        self.view_start = None
+        self.view_sql = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[PARAMETERS.sub('?', sql)] += 1
+
+    def repeated(self):
+        """SQL, повторённый больше METRICS_N_PLUS_ONE раз, или ''."""
+        if not self.shapes:
+            return ''
+        sql, count = self.shapes.most_common(1)[0]
+        return sql if count > settings.METRICS_N_PLUS_ONE else ''
+
+    def start_view(self):
+        self.view_start = time.perf_counter()
+        self.view_sql = self.sql
+
+    def serializer(self, end):
+        """Время view и рендера ответа без SQL: сериализация и прочая
+        работа Python от process_view до готового ответа."""
+        if self.view_start is None:
+            return 0
+        return max(end - self.view_start - (self.sql - self.view_sql), 0)
+
+
+def get_endpoint(request, view_func):
+    """Имя view.action, например RecipeViewSet.list."""
+    view = getattr(view_func, 'cls', None)
+    if view is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__name__)
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return '{}.{}'.format(view.__name__, actions.get(method, method))
+
+
+class MetricsMiddleware:
+    """Число и время SQL, время сериализации и ответа по view.action.
+
+    Включается METRICS_ENABLED. Если один и тот же SQL с точностью до
+    параметров выполняется больше METRICS_N_PLUS_ONE раз, запрос
+    отмечается как N+1 и пишется в лог. Время сериализации считается
+    по хукам middleware, без подмены классов DRF.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measurement = Measurement()
+        _local.measurement = measurement
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(measurement))
+                response = self.get_response(request)
+        finally:
+            _local.measurement = None
+        end = time.perf_counter()
+        endpoint = getattr(request, 'metrics_endpoint', UNRESOLVED)
+        if endpoint is not None:
+            repeated = measurement.repeated()
+            if repeated:
+                logger.warning(N_PLUS_ONE, endpoint,
+                               measurement.shapes[repeated], repeated)
+            registry.record(
+                endpoint, end - start, measurement.queries, measurement.sql,
+                measurement.serializer(end), repeated)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_endpoint = (
+            None if getattr(view_func, 'metrics_exempt', False)
+            else get_endpoint(request, view_func))
+        measurement = getattr(_local, 'measurement', None)
+        if measurement is not None:
+            measurement.start_view()
@@ -0,0 +1,162 @@
+import os
+import threading
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Границы корзин гистограммы времени ответа в секундах.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FIELDS = ('count', 'duration', 'queries', 'sql', 'serializer', 'n_plus_one')
+# Снимок процесса пишется в общий кеш раз в FLUSH_EVERY запросов.
+FLUSH_EVERY = 100
+PROCESSES = 'metrics:processes'
+
+PROCESS = 'metrics:process:{}:{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+
+_endpoints = {}
+_lock = threading.Lock()
+_recorded = 0
+
+
+def empty():
+    stats = dict.fromkeys(FIELDS, 0)
+    stats.update(buckets=[0] * (len(BUCKETS) + 1), max=0, example='')
+    return stats
+
+
+def record(endpoint, duration, queries, sql, serializer, repeated=''):
+    """Добавляет замер запроса к статистике view.action в процессе.
+
+    repeated - SQL, повторённый больше METRICS_N_PLUS_ONE раз.
+    """
+    global _recorded
+    with _lock:
+        stats = _endpoints.setdefault(endpoint, empty())
+        stats['buckets'][bisect_left(BUCKETS, duration)] += 1
+        stats['count'] += 1
+        stats['duration'] += duration
+        stats['queries'] += queries
+        stats['sql'] += sql
+        stats['serializer'] += serializer
+        stats['max'] = max(stats['max'], duration)
+        if repeated:
+            stats['n_plus_one'] += 1
+            stats['example'] = repeated
+        _recorded += 1
+        if _recorded % FLUSH_EVERY:
+            return
+        snapshot = local_snapshot()
+    save(snapshot)
+
+
+def local_snapshot():
+    return {endpoint: dict(stats, buckets=list(stats['buckets']))
+            for endpoint, stats in _endpoints.items()}
+
+
+def get_cache():
+    return caches[settings.RECIPES_CACHE]
+
+
+def save(snapshot):
+    cache = get_cache()
+    cache.set(PROCESS, snapshot, None)
+    processes = cache.get(PROCESSES, [])
+    if PROCESS not in processes:
+        cache.set(PROCESSES, processes + [PROCESS], None)
+
+
+def merge(total, stats):
+    for field in FIELDS:
+        total[field] += stats[field]
+    total['buckets'] = [
+        left + right for left, right in zip(total['buckets'],
+                                            stats['buckets'])]
+    total['max'] = max(total['max'], stats['max'])
+    total['example'] = total['example'] or stats['example']
+
+
+def collect():
+    """Статистика всех процессов: этот - на сейчас, другие - на снимок."""
+    with _lock:
+        snapshots = {PROCESS: local_snapshot()}
+    cache = get_cache()
+    processes = [process for process in cache.get(PROCESSES, [])
+                 if process != PROCESS]
+    snapshots.update(cache.get_many(processes))
+    endpoints = {}
+    for snapshot in snapshots.values():
+        for endpoint, stats in snapshot.items():
+            merge(endpoints.setdefault(endpoint, empty()), stats)
+    return endpoints
+
+
+def reset():
+    """Забывает статистику этого процесса и снимки всех остальных."""
+    global _recorded
+    with _lock:
+        _endpoints.clear()
+        _recorded = 0
+    cache = get_cache()
+    cache.delete_many(cache.get(PROCESSES, []) + [PROCESSES])
+
+
+def percentile(stats, percent):
+    """Оценка перцентиля по гистограмме: верхняя граница корзины."""
+    rank = stats['count'] * percent / 100
+    seen = 0
+    for bound, count in zip(BUCKETS + (None,), stats['buckets']):
+        seen += count
+        if count and seen >= rank:
+            return stats['max'] if bound is None else min(bound, stats['max'])
+    return 0
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render(endpoints, counters=()):
+    """Текстовый формат Prometheus.
+
+    counters - тройки (имя метрики, метки, значение) для счётчиков кешей.
+    """
+    lines = [
+        '# HELP foodgram_request_duration_seconds Время ответа',
+        '# TYPE foodgram_request_duration_seconds histogram',
+    ]
+    for endpoint, stats in sorted(endpoints.items()):
+        name = label(endpoint)
+        seen = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), stats['buckets']):
+            seen += count
+            lines.append(
+                'foodgram_request_duration_seconds_bucket'
+                '{{endpoint="{}",le="{}"}} {}'.format(name, bound, seen))
+        lines.append('foodgram_request_duration_seconds_sum'
+                     '{{endpoint="{}"}} {}'.format(name, stats['duration']))
+        lines.append('foodgram_request_duration_seconds_count'
+                     '{{endpoint="{}"}} {}'.format(name, stats['count']))
+    for metric, field, help in (
+            ('sql_queries', 'queries', 'Запросов к базе'),
+            ('sql_duration_seconds', 'sql', 'Время запросов к базе'),
+            ('serializer_duration_seconds', 'serializer',
+             'Время view и рендера без SQL'),
+            ('n_plus_one', 'n_plus_one', 'Ответов с повторами SQL')):
+        lines.append('# HELP foodgram_{}_total {}'.format(metric, help))
+        lines.append('# TYPE foodgram_{}_total counter'.format(metric))
+        lines.extend(
+            'foodgram_{}_total{{endpoint="{}"}} {}'.format(
+                metric, label(endpoint), stats[field])
+            for endpoint, stats in sorted(endpoints.items()))
+    typed = set()
+    for metric, labels, value in counters:
+        if metric not in typed:
+            typed.add(metric)
+            lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{}{{{}}} {}'.format(metric, ','.join(
+            '{}="{}"'.format(key, label(item))
+            for key, item in labels.items()), value))
+    return '\n'.join(lines) + '\n'
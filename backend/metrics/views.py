@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+from recipes import cache as recipes_cache
+from users import authentication
+
+from . import registry
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def get_counters():
+    """Попадания и промахи кеша ответов и кеша токенов."""
+    for metric, stats in (
+            ('foodgram_response_cache_total', recipes_cache.get_stats()),
+            ('foodgram_token_cache_total', authentication.get_stats())):
+        for result, value in stats.items():
+            yield metric, {'result': result}, value
+
+
+def metrics(request):
+    """Метрики для Prometheus: при METRICS_TOKEN - по Bearer-токену,
+    без него - только администраторам, вошедшим в админку."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        allowed = request.META.get(
+            'HTTP_AUTHORIZATION') == 'Bearer ' + settings.METRICS_TOKEN
+    else:
+        allowed = request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(registry.collect(), get_counters()),
+        content_type=CONTENT_TYPE)
+
+
+metrics.metrics_exempt = True
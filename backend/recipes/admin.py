@@ -19,14 +19,15 @@ class RecipeIgredientInline(admin.StackedInline):
 
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIgredientInline,)
-    list_display = ('id', 'name', 'author')
+    list_display = ('id', 'name', 'author', 'favorites')
     list_filter = ('name', 'author', 'tags')
     readonly_fields = ('favorites',)
 
     def favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     favorites.short_description = 'В избранном'
+    favorites.admin_order_field = 'favorites_count'
 
 
 admin.site.register(Tag, TagAdmin)
@@ -0,0 +1,262 @@
+import json
+import os
+import uuid
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+from users.models import User
+from .cache import (LISTS, evict_lists_on_commit, get_ingredient_ids,
+                    get_tag_ids)
+from .images import archive_to_file, schedule, to_data_uri, to_file
+from .models import FeedItem, Recipe, RecipeIngredient
+from .serializers import (CHECK_AMOUNT, CHECK_AMOUNT_FORMAT, CHECK_TIME,
+                          INGREDIENS_KEY_ERROR, INGREDIENT_NOT_CORRECT,
+                          SAME_INGREDIENT, TAGS_KEY_ERROR, to_int)
+
+BATCH_SIZE = 200
+EXPORT_CHUNK_SIZE = 500
+
+ROW_NOT_JSON = 'Строка не является JSON: {}'
+ROW_NOT_OBJECT = 'Строка должна быть JSON-объектом'
+FIELD_REQUIRED = 'Обязательное поле'
+FIELD_TOO_LONG = 'Не больше {} символов'
+TAG_SLUG_NOT_FOUND = 'Тег со слагом {} не существует'
+INGREDIENT_NAME_NOT_FOUND = 'Ингредиент {} не существует'
+AUTHOR_NOT_FOUND = 'Пользователь {} не существует'
+AUTHOR_NOT_CORRECT = 'Автор указывается именем пользователя'
+IMAGE_ARCHIVE_REQUIRED = 'Картинка {} указана без архива картинок'
+
+
+def read_lines(lines):
+    """Разбирает строки NDJSON в пары (номер строки, объект)."""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as error:
+            yield number, error
+
+
+class RecipeImporter:
+    """Импорт рецептов из NDJSON пакетами.
+
+    Теги указываются слагами, ингредиенты — названиями, картинка — data URI
+    или именем файла в zip-архиве. Каждый пакет пишется отдельной
+    транзакцией, ошибки собираются по номерам строк.
+    """
+
+    def __init__(self, author=None, archive=None, batch_size=BATCH_SIZE):
+        self.author = author
+        self.archive = archive
+        self.batch_size = batch_size
+        self.created = 0
+        self.errors = []
+
+    def run(self, lines):
+        rows = read_lines(lines)
+        for batch in iter(lambda: list(islice(rows, self.batch_size)), []):
+            self.import_batch(batch)
+        return {'created': self.created, 'errors': self.errors}
+
+    def import_batch(self, batch):
+        authors = self.get_authors(batch)
+        tags = get_tag_ids()
+        ingredients = get_ingredient_ids()
+        valid = []
+        for number, row in batch:
+            errors = {}
+            recipe = self.clean(row, authors, tags, ingredients, errors)
+            if errors:
+                self.errors.append({'line': number, 'errors': errors})
+            else:
+                valid.append(recipe)
+        if valid:
+            self.write(valid)
+            self.created += len(valid)
+
+    def get_authors(self, batch):
+        if self.author is not None:
+            return {}
+        usernames = {row.get('author') for number, row in batch
+                     if isinstance(row, dict)
+                     and isinstance(row.get('author'), str)}
+        return User.objects.in_bulk(usernames, field_name='username')
+
+    def clean_author(self, username, authors, errors):
+        if self.author is not None:
+            return self.author
+        if username is None:
+            errors['author'] = [FIELD_REQUIRED]
+        elif not isinstance(username, str):
+            errors['author'] = [AUTHOR_NOT_CORRECT]
+        elif username not in authors:
+            errors['author'] = [AUTHOR_NOT_FOUND.format(username)]
+        else:
+            return authors[username]
+        return None
+
+    def clean(self, row, authors, tags, ingredients, errors):
+        """Проверяет строку и сохраняет картинку, если ошибок нет."""
+        if isinstance(row, ValueError):
+            errors['non_field_errors'] = [ROW_NOT_JSON.format(row)]
+            return None
+        if not isinstance(row, dict):
+            errors['non_field_errors'] = [ROW_NOT_OBJECT]
+            return None
+        recipe = Recipe(author=self.clean_author(
+            row.get('author'), authors, errors))
+        for field in ('name', 'text'):
+            setattr(recipe, field, self.clean_text(row, field, errors))
+        recipe.cooking_time = to_int(row.get('cooking_time'))
+        if recipe.cooking_time is None or recipe.cooking_time <= 0:
+            errors['cooking_time'] = [CHECK_TIME]
+        recipe.tag_ids = self.clean_tags(row.get('tags'), tags, errors)
+        recipe.amounts = self.clean_ingredients(
+            row.get('ingredients'), ingredients, errors)
+        if not isinstance(row.get('image'), str):
+            errors['image'] = [FIELD_REQUIRED]
+        if not errors:
+            try:
+                recipe.image = self.save_image(row['image'])
+            except serializers.ValidationError as error:
+                errors['image'] = error.detail
+        return recipe
+
+    def clean_text(self, row, field, errors):
+        value = row.get(field)
+        max_length = Recipe._meta.get_field(field).max_length
+        if not isinstance(value, str) or not value.strip():
+            errors[field] = [FIELD_REQUIRED]
+        elif len(value) > max_length:
+            errors[field] = [FIELD_TOO_LONG.format(max_length)]
+        else:
+            return value
+        return ''
+
+    def clean_tags(self, slugs, tags, errors):
+        if not isinstance(slugs, list) or not slugs:
+            errors['tags'] = [TAGS_KEY_ERROR]
+            return set()
+        unknown = [slug for slug in slugs
+                   if not isinstance(slug, str) or slug not in tags]
+        if unknown:
+            errors['tags'] = [TAG_SLUG_NOT_FOUND.format(slug)
+                              for slug in unknown]
+        return {tags[slug] for slug in slugs if slug not in unknown}
+
+    def clean_ingredients(self, items, ingredients, errors):
+        if not isinstance(items, list) or not items:
+            errors['ingredients'] = [INGREDIENS_KEY_ERROR]
+            return {}
+        amounts = {}
+        messages = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(
+                    item.get('name'), str):
+                messages.append(INGREDIENT_NOT_CORRECT)
+                continue
+            name = item['name']
+            id = ingredients.get(name)
+            amount = to_int(item.get('amount'))
+            if id is None:
+                messages.append(INGREDIENT_NAME_NOT_FOUND.format(name))
+            elif id in amounts:
+                messages.append(SAME_INGREDIENT.format(name))
+            elif amount is None:
+                messages.append(CHECK_AMOUNT_FORMAT.format(name))
+            elif amount <= 0:
+                messages.append(CHECK_AMOUNT.format(name))
+            else:
+                amounts[id] = amount
+        if messages:
+            errors['ingredients'] = messages
+        return amounts
+
+    def save_image(self, value):
+        """Сохраняет картинку сразу, не держа пакет файлов в памяти.
+
+        Если транзакция пакета не пройдёт, файл удалит collect_recipe_images.
+        """
+        name = uuid.uuid4()
+        if value.startswith('data:'):
+            file = to_file(value, name)
+        elif self.archive is None:
+            raise serializers.ValidationError(
+                IMAGE_ARCHIVE_REQUIRED.format(value))
+        else:
+            file = archive_to_file(self.archive, value, name)
+        field = Recipe._meta.get_field('image')
+        with file:
+            return field.storage.save(
+                field.generate_filename(None, file.name), file)
+
+    @transaction.atomic
+    def write(self, recipes):
+        if connection.features.can_return_ids_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag)
+            for recipe in recipes for tag in recipe.tag_ids)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=id, amount=amount)
+            for recipe in recipes for id, amount in recipe.amounts.items())
+        evict_lists_on_commit(LISTS)
+        fan_out = FeedItem.objects.enabled()
+        for recipe in recipes:
+            if fan_out:
+                FeedItem.objects.fan_out(recipe)
+            schedule(recipe.id)
+
+
+def export_recipes(queryset, archive=None):
+    """Строки NDJSON в формате импорта, рецепты читаются частями.
+
+    С архивом картинки записываются в него под именами файлов, без архива
+    встраиваются в строку как data URI.
+    """
+    queryset = queryset.select_related('author').prefetch_related(
+        'tags', Prefetch('recipeingredient_set',
+                         queryset=RecipeIngredient.objects.select_related(
+                             'ingredient'))).order_by('id')
+    written = set()
+    last = 0
+    while True:
+        recipes = list(queryset.filter(id__gt=last)[:EXPORT_CHUNK_SIZE])
+        if not recipes:
+            return
+        for recipe in recipes:
+            yield json.dumps({
+                'author': recipe.author.username,
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'tags': [tag.slug for tag in recipe.tags.all()],
+                'ingredients': [{
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                } for item in recipe.recipeingredient_set.all()],
+                'image': export_image(recipe.image, archive, written),
+            }, ensure_ascii=False) + '\n'
+        last = recipes[-1].id
+
+
+def export_image(image, archive, written):
+    if archive is None:
+        return to_data_uri(image)
+    name = os.path.basename(image.name)
+    if name not in written:
+        with image.open('rb') as source, archive.open(name, 'w') as target:
+            for chunk in source.chunks():
+                target.write(chunk)
+        written.add(name)
+    return name
@@ -0,0 +1,362 @@
+import calendar
+import hashlib
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import DataVersion, Ingredient, Recipe, Tag
+
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+ALL = 'all'
+LISTS = 'lists'
+POPULAR = 'popular'
+HIT = 'hit'
+MISS = 'miss'
+
+_responses = {}
+_tag_ids = (None, {})
+_ingredient_ids = (None, {})
+
+
+def get_version(name):
+    version = DataVersion.objects.filter(name=name).values_list(
+        'version', flat=True).first()
+    return version or 0
+
+
+def bump_version(name):
+    """Отмечает справочник изменённым во всех процессах."""
+    if not DataVersion.objects.filter(name=name).update(
+            version=F('version') + 1):
+        DataVersion.objects.get_or_create(name=name, defaults={'version': 1})
+
+
+def get_tag_ids():
+    """Словарь {slug: id} тегов текущей версии, хранится в процессе."""
+    global _tag_ids
+    version = get_version(TAGS)
+    if _tag_ids[0] != version:
+        _tag_ids = (version, dict(Tag.objects.values_list('slug', 'id')))
+    return _tag_ids[1]
+
+
+def get_ingredient_ids():
+    """Словарь {название: id} ингредиентов текущей версии."""
+    global _ingredient_ids
+    version = get_version(INGREDIENTS)
+    if _ingredient_ids[0] != version:
+        _ingredient_ids = (
+            version, dict(Ingredient.objects.values_list('name', 'id')))
+    return _ingredient_ids[1]
+
+
+def get_responses(name, version):
+    """Ответы текущей версии справочника, сохранённые в этом процессе."""
+    cached_version, responses = _responses.get(name, (None, None))
+    if cached_version != version:
+        responses = OrderedDict()
+        _responses[name] = (version, responses)
+    return responses
+
+
+def render(view, request, data):
+    """Байты и Content-Type ответа, как их отдал бы рендерер DRF."""
+    content_type = request.accepted_media_type
+    if request.accepted_renderer.charset:
+        content_type = '{}; charset={}'.format(
+            content_type, request.accepted_renderer.charset)
+    content = request.accepted_renderer.render(
+        data, request.accepted_media_type, view.get_renderer_context())
+    return content, content_type
+
+
+class CachedReferenceMixin:
+    """Отдаёт готовые байты ответа справочника из памяти процесса.
+
+    Ключ кэша - версия справочника, действие, id и параметры запроса.
+    ETag строится по тому же ключу, поэтому 304 отдаётся без
+    сериализации.
+    """
+    reference_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        version = get_version(self.reference_name)
+        key = '{}|{}|{}|{}'.format(
+            self.action, request.accepted_media_type, kwargs.get('pk', ''),
+            '&'.join(sorted(request.query_params.urlencode().split('&'))))
+        etag = '"{}-{}-{}"'.format(
+            self.reference_name, version,
+            hashlib.sha1(key.encode()).hexdigest()[:16])
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.get_cached(handler, request, version, key,
+                                       *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, must_revalidate=True,
+                            max_age=settings.REFERENCE_CACHE_MAX_AGE)
+        return response
+
+    def get_cached(self, handler, request, version, key, *args, **kwargs):
+        responses = get_responses(self.reference_name, version)
+        if key in responses:
+            responses.move_to_end(key)
+            content, content_type = responses[key]
+            return HttpResponse(content, content_type=content_type)
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        content, content_type = render(self, request, response.data)
+        responses[key] = (content, content_type)
+        while len(responses) > settings.REFERENCE_CACHE_SIZE:
+            responses.popitem(last=False)
+        return HttpResponse(content, content_type=content_type)
+
+
+def get_response_cache():
+    return caches[settings.RECIPES_CACHE]
+
+
+def get_generation(name):
+    """Поколение ключей кэша ответов.
+
+    Случайная строка, а не счётчик: если ключ поколения вытеснен из
+    кэша, новое поколение не совпадёт ни с одним старым.
+    """
+    return get_response_cache().get_or_set(
+        'recipes:generation:{}'.format(name), uuid.uuid4().hex, None)
+
+
+def bump_generation(name):
+    get_response_cache().set(
+        'recipes:generation:{}'.format(name), uuid.uuid4().hex, None)
+
+
+def pages_key(recipe_id):
+    return 'recipes:pages:{}'.format(recipe_id)
+
+
+def detail_key(recipe_id):
+    return 'recipes:detail:{}:{}'.format(get_generation(ALL), recipe_id)
+
+
+def list_key(request):
+    params = request.query_params
+    query = '&'.join('{}={}'.format(name, ','.join(sorted(params.getlist(
+        name)))) for name in sorted(params))
+    generations = [get_generation(ALL), get_generation(LISTS)] + [
+        get_generation('tag:{}'.format(slug))
+        for slug in sorted(set(params.getlist('tags')))]
+    if params.get('ordering') == POPULAR:
+        generations.append(get_generation(POPULAR))
+    key = '{}|{}|{}'.format(
+        '|'.join(generations), request.build_absolute_uri('/'), query)
+    return 'recipes:list:{}'.format(hashlib.md5(key.encode()).hexdigest())
+
+
+def remember_pages(key, recipe_ids):
+    """Запоминает, на каких страницах списка есть каждый рецепт."""
+    cache = get_response_cache()
+    for recipe_id in recipe_ids:
+        keys = cache.get(pages_key(recipe_id), set())
+        keys.add(key)
+        cache.set(pages_key(recipe_id), keys, settings.RECIPES_CACHE_TIMEOUT)
+
+
+def evict_recipe(recipe_id):
+    """Удаляет страницу рецепта и страницы списков, где он есть."""
+    cache = get_response_cache()
+    keys = cache.get(pages_key(recipe_id), set())
+    cache.delete_many(list(keys) + [detail_key(recipe_id),
+                                    pages_key(recipe_id)])
+
+
+def evict_recipe_on_commit(recipe_id):
+    transaction.on_commit(lambda: evict_recipe(recipe_id))
+
+
+def evict_lists_on_commit(*names):
+    transaction.on_commit(
+        lambda: [bump_generation(name) for name in names])
+
+
+def user_key(user_id):
+    return 'user:{}'.format(user_id)
+
+
+def touch(*names):
+    """Запоминает время изменения, которого не видно по Recipe.modified."""
+    now = timezone.now()
+    get_response_cache().set_many(
+        {'recipes:touched:{}'.format(name): now for name in names}, None)
+
+
+def touch_on_commit(*names):
+    transaction.on_commit(lambda: touch(*names))
+
+
+def get_touched(*names):
+    """Время последнего touch, вытесненные из кеша - текущее время."""
+    cache = get_response_cache()
+    keys = ['recipes:touched:{}'.format(name) for name in names]
+    touched = cache.get_many(keys)
+    missing = {key: timezone.now() for key in keys if key not in touched}
+    if missing:
+        cache.set_many(missing, None)
+        touched.update(missing)
+    return [touched[key] for key in keys]
+
+
+def conditional_response(request, etag, last_modified, handler):
+    """304 по If-None-Match и If-Modified-Since или ответ handler.
+
+    Ответ со статусом 200 получает заголовки ETag и Last-Modified.
+    """
+    timestamp = calendar.timegm(last_modified.utctimetuple())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = handler()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def count(name):
+    cache = get_response_cache()
+    key = 'recipes:stats:{}'.format(name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_stats():
+    cache = get_response_cache()
+    return {name: cache.get('recipes:stats:{}'.format(name), 0)
+            for name in (HIT, MISS)}
+
+
+class AnonymousCacheMixin:
+    """Общий кэш ответов списка и страницы рецепта для анонимов.
+
+    Ключ списка учитывает параметры запроса и поколения: общее, списков
+    и каждого тега из фильтра. Страница рецепта и страницы списков с ним
+    удаляются точечно при изменении рецепта.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.anonymous_cached(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.anonymous_cached(
+            super().retrieve, request, *args, **kwargs)
+
+    def anonymous_cached(self, handler, request, *args, **kwargs):
+        if (request.user.is_authenticated
+                or request.accepted_renderer.format != 'json'):
+            return handler(request, *args, **kwargs)
+        if self.action == 'retrieve':
+            # /07/ и /7/ - один рецепт, evict_recipe удаляет ключ по числу.
+            try:
+                key = detail_key(int(kwargs['pk']))
+            except ValueError:
+                return handler(request, *args, **kwargs)
+        else:
+            key = list_key(request)
+        cache = get_response_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            count(HIT)
+            response = HttpResponse(cached[0], content_type=cached[1])
+            response['X-Cache'] = 'HIT'
+            return response
+        count(MISS)
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        content, content_type = render(self, request, response.data)
+        cache.set(key, (content, content_type),
+                  settings.RECIPES_CACHE_TIMEOUT)
+        if self.action == 'list':
+            results = response.data
+            if isinstance(results, dict):
+                results = results['results']
+            remember_pages(key, [recipe['id'] for recipe in results])
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalMixin:
+    """Ответ 304 для list и retrieve без сериализации.
+
+    ETag и Last-Modified строятся по max(modified) и числу рецептов после
+    фильтров, а также по изменениям, которых modified не видит: удалению
+    рецептов, порядку ordering=popular, избранному, корзине и подпискам
+    пользователя. Фильтры применяются один раз: list и retrieve получают
+    тот же отфильтрованный queryset.
+    """
+    filtered = None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            super().retrieve, request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        if self.filtered is not None:
+            return self.filtered
+        return super().filter_queryset(queryset)
+
+    def conditional(self, handler, request, *args, **kwargs):
+        names = [LISTS]
+        if self.action == 'retrieve':
+            names = []
+            if not str(kwargs['pk']).isdigit():
+                return handler(request, *args, **kwargs)
+        self.filtered = super().filter_queryset(self.get_queryset())
+        # Без аннотаций представления, только рецепты, прошедшие фильтры.
+        queryset = Recipe.objects.filter(pk__in=self.filtered.values('pk'))
+        if self.action == 'retrieve':
+            queryset = queryset.filter(pk=kwargs['pk'])
+        if request.query_params.get('ordering') == POPULAR:
+            names.append(POPULAR)
+        if request.user.is_authenticated:
+            names.append(user_key(request.user.id))
+        stats = queryset.aggregate(modified=Max('modified'), count=Count('id'))
+        if stats['modified'] is None:
+            return handler(request, *args, **kwargs)
+        touched = get_touched(*names)
+        key = '|'.join(str(part) for part in [
+            self.action, request.accepted_media_type, request.get_full_path(),
+            request.user.id, stats['count'], stats['modified']] + touched)
+        etag = '"{}"'.format(hashlib.sha1(key.encode()).hexdigest()[:16])
+        return conditional_response(
+            request, etag, max([stats['modified']] + touched),
+            lambda: handler(request, *args, **kwargs))
@@ -1,11 +1,17 @@
 from enum import Enum
 
 from django_filters import rest_framework as filter
-from django_filters.filters import (AllValuesMultipleFilter, ModelChoiceFilter,
-                                    NumberFilter)
+from django.db.models import Count, Exists, OuterRef
+from django.utils.functional import cached_property
+from django_filters.filters import (ChoiceFilter, ModelChoiceFilter,
+                                    MultipleChoiceFilter, NumberFilter)
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
 
 from users.models import User
+from .cache import POPULAR, get_tag_ids
 from .models import Recipe
+from .search import search
 
 
 class IsFavorited(Enum):
@@ -18,15 +24,59 @@ class IsInCart(Enum):
     NOT_IN = 0
 
 
+class TagsMode(Enum):
+    ANY = 'any'
+    ALL = 'all'
+
+
 class RecipeFilter(filter.FilterSet):
     is_favorited = NumberFilter(method='get_is_favorited')
     is_in_shopping_cart = NumberFilter(method='get_is_in_shopping_cart')
     author = ModelChoiceFilter(queryset=User.objects.all())
-    tags = AllValuesMultipleFilter(field_name='tags__slug')
+    tags = MultipleChoiceFilter(method='get_tags')
+    tags_mode = ChoiceFilter(
+        choices=[(mode.value, mode.value) for mode in TagsMode],
+        method='get_tags_mode')
+    ordering = ChoiceFilter(choices=((POPULAR, POPULAR),),
+                            method='get_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags')
+        fields = ('is_favorited', 'is_in_shopping_cart', 'author', 'tags',
+                  'tags_mode', 'ordering')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Форма обращается к choices несколько раз, теги читаются однажды.
+        self.filters['tags'].extra['choices'] = lambda: [
+            (slug, slug) for slug in self.tag_ids]
+
+    @cached_property
+    def tag_ids(self):
+        return get_tag_ids()
+
+    def get_tags(self, queryset, name, value):
+        """Рецепты с любым (или со всеми при tags_mode=all) из тегов.
+
+        Фильтр через один EXISTS не размножает строки и не требует
+        DISTINCT.
+        """
+        ids = {self.tag_ids[slug] for slug in value}
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=ids)
+        if self.form.cleaned_data.get('tags_mode') == TagsMode.ALL.value:
+            recipe_tags = recipe_tags.values('recipe').annotate(
+                count=Count('tag')).filter(count=len(ids))
+        return queryset.annotate(has_tags=Exists(recipe_tags)).filter(
+            has_tags=True)
+
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def get_ordering(self, queryset, name, value):
+        if value == POPULAR:
+            return queryset.order_by('-favorites_count', '-id')
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -39,3 +89,15 @@ class RecipeFilter(filter.FilterSet):
         if value == IsInCart.IN.value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+
+class IngredientSearchFilter(BaseFilterBackend):
+    """Автодополнение: сначала совпадения с начала названия,
+    затем по подстроке и похожести."""
+
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(api_settings.SEARCH_PARAM, '').strip()
+        if not name or view.action != 'list':
+            return queryset
+        limit = view.paginator.get_limit(request)
+        return search(queryset, name, limit)
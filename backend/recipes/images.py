@@ -0,0 +1,253 @@
+import base64
+import binascii
+import io
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+from .cache import evict_recipe
+
+THUMBNAIL = 'thumbnail'
+CARD = 'card'
+FULL = 'full'
+# Кратно 4, чтобы каждый кусок base64 декодировался отдельно.
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+SVG = 'svg'
+BASE64 = ';base64,'
+
+IMAGE_NOT_CORRECT = 'Картинка должна быть строкой data:image/...;base64,...'
+IMAGE_TOO_LARGE = 'Размер картинки больше {} байт'
+IMAGE_NOT_IN_ARCHIVE = 'Картинки {} нет в архиве'
+IMAGE_WRONG_TYPE = 'Файл не является картинкой JPEG, PNG, GIF или WebP'
+
+logger = logging.getLogger(__name__)
+_executor = None
+
+
+def decode(data):
+    """Декодирует data URI кусками во временный файл.
+
+    Возвращает файл и расширение, определённое по содержимому, а не по
+    заголовку data URI.
+    """
+    start = data.find(BASE64) if isinstance(data, str) else -1
+    if start < 0:
+        raise serializers.ValidationError(IMAGE_NOT_CORRECT)
+    # Куски берутся срезами data, без копии всей строки base64.
+    header = data[:start]
+    start += len(BASE64)
+    max_size = settings.RECIPE_IMAGE_MAX_BYTES
+    if (len(data) - start) * 3 // 4 > max_size + 2:
+        raise serializers.ValidationError(IMAGE_TOO_LARGE.format(max_size))
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        for offset in range(start, len(data), CHUNK_SIZE):
+            file.write(base64.b64decode(
+                data[offset:offset + CHUNK_SIZE], validate=True))
+    except (binascii.Error, ValueError):
+        file.close()
+        raise serializers.ValidationError(IMAGE_NOT_CORRECT)
+    file.seek(0)
+    return file, detect_extension(file, header)
+
+
+def detect_extension(file, header):
+    if header.startswith('data:image/svg'):
+        start = file.read(1024).lstrip()
+        file.seek(0)
+        if start.startswith(b'<') and b'<svg' in start.lower():
+            return SVG
+        raise serializers.ValidationError(IMAGE_WRONG_TYPE)
+    try:
+        with Image.open(file) as image:
+            image.verify()
+            format = image.format
+    except (UnidentifiedImageError, OSError, SyntaxError,
+            Image.DecompressionBombError):
+        raise serializers.ValidationError(IMAGE_WRONG_TYPE)
+    finally:
+        file.seek(0)
+    if format not in FORMATS:
+        raise serializers.ValidationError(IMAGE_WRONG_TYPE)
+    return FORMATS[format]
+
+
+def to_file(data, name):
+    file, ext = decode(data)
+    return File(file, name='{}.{}'.format(name, ext))
+
+
+def archive_to_file(archive, member, name):
+    """Проверяет картинку из zip-архива так же, как data URI."""
+    try:
+        info = archive.getinfo(member)
+    except KeyError:
+        raise serializers.ValidationError(IMAGE_NOT_IN_ARCHIVE.format(member))
+    max_size = settings.RECIPE_IMAGE_MAX_BYTES
+    if info.file_size > max_size:
+        raise serializers.ValidationError(IMAGE_TOO_LARGE.format(max_size))
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with archive.open(info) as source:
+        shutil.copyfileobj(source, file, CHUNK_SIZE)
+    file.seek(0)
+    header = 'data:image/svg' if member.lower().endswith('.svg') else ''
+    return File(file, name='{}.{}'.format(
+        name, detect_extension(file, header)))
+
+
+def to_data_uri(image):
+    """Кодирует файл картинки в data URI кусками."""
+    content_type = mimetypes.guess_type(image.name)[0] or 'image/jpeg'
+    parts = ['data:{};base64,'.format(content_type)]
+    with image.open('rb') as file:
+        # Кратно 3, чтобы куски base64 склеивались без дополнения.
+        for chunk in iter(lambda: file.read(CHUNK_SIZE * 3 // 4), b''):
+            parts.append(base64.b64encode(chunk).decode())
+    return ''.join(parts)
+
+
+def variant_name(name, variant):
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'variants', '{}.{}.{}'.format(
+        os.path.splitext(filename)[0], variant,
+        settings.RECIPE_IMAGE_FORMAT.lower()))
+
+
+def variant_names(name):
+    return [variant_name(name, variant)
+            for variant in settings.RECIPE_IMAGE_VARIANTS]
+
+
+def image_url(name, storage, variant=None):
+    """Адрес картинки по имени файла или её варианта, если он указан."""
+    if not name:
+        return None
+    if variant:
+        return default_storage.url(variant_name(name, variant))
+    return storage.url(name)
+
+
+def variant_url(image, variant):
+    """Адрес варианта картинки, если он уже готов, иначе оригинала."""
+    if not image:
+        return None
+    ready = getattr(image.instance, 'image_ready', False)
+    return image_url(image.name, image.storage, variant if ready else None)
+
+
+def make_variants(image, name, storage):
+    """Уменьшает картинку до каждого размера и сохраняет в хранилище."""
+    image = ImageOps.exif_transpose(image)
+    format = settings.RECIPE_IMAGE_FORMAT
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        copy = image.copy()
+        copy.thumbnail(size, Image.LANCZOS)
+        if format == 'JPEG' and copy.mode != 'RGB':
+            copy = copy.convert('RGB')
+        buffer = io.BytesIO()
+        copy.save(buffer, format, quality=settings.RECIPE_IMAGE_QUALITY)
+        path = variant_name(name, variant)
+        storage.delete(path)
+        saved = storage.save(path, File(buffer))
+        if saved != path:
+            # Тот же вариант уже записал другой поток.
+            storage.delete(saved)
+
+
+def process(recipe_id):
+    """Готовит варианты картинки рецепта и отмечает их готовность."""
+    from .models import Recipe
+
+    try:
+        recipe = Recipe.objects.filter(id=recipe_id).first()
+        if recipe is None or not recipe.image:
+            return
+        name = recipe.image.name
+        if name.endswith('.' + SVG):
+            return
+        if not all(map(default_storage.exists, variant_names(name))):
+            with recipe.image.open('rb') as file, Image.open(file) as image:
+                make_variants(image, name, default_storage)
+        if Recipe.objects.filter(id=recipe_id, image=name).update(
+                image_ready=True, modified=timezone.now()):
+            evict_recipe(recipe_id)
+    except Exception:
+        logger.exception('Image variants for recipe %s failed', recipe_id)
+    finally:
+        if _executor is not None:
+            connections.close_all()
+
+
+def release(name, storage):
+    """Удаляет картинку и её варианты, если на неё не ссылается рецепт.
+
+    Недавно загруженные файлы оставляет сборщику мусора: на них может
+    ссылаться ещё не зафиксированная транзакция.
+    """
+    from .models import Recipe
+
+    if (not name or not storage.exists(name) or storage.is_recent(name)
+            or Recipe.objects.filter(image=name).exists()):
+        return
+    storage.delete(name)
+    for path in variant_names(name):
+        default_storage.delete(path)
+
+
+def release_on_commit(name, storage):
+    transaction.on_commit(lambda: release(name, storage))
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images')
+    return _executor
+
+
+def schedule(recipe_id):
+    """Ставит обработку картинки в пул после фиксации транзакции.
+
+    При RECIPE_IMAGE_WORKERS = 0 обработка идёт сразу в этом потоке.
+    """
+    def submit():
+        if settings.RECIPE_IMAGE_WORKERS:
+            get_executor().submit(process, recipe_id)
+        else:
+            process(recipe_id)
+    transaction.on_commit(submit)
+
+
+class RecipeImageField(serializers.ImageField):
+    """Картинка рецепта: отдаёт адрес нужного варианта."""
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def get_variant(self):
+        return self.variant
+
+    def to_representation(self, value):
+        url = variant_url(value, self.get_variant())
+        if url is None:
+            return None
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from recipes.models import FeedItem, Recipe
+from users.models import User
+
+RESULT = ('{:<6} подписок в среднем {:.0f}: медиана {:.2f} мс, '
+          'p95 {:.2f} мс на {} страниц')
+
+
+def read_feed(user):
+    return Recipe.objects.filter(author__following__user=user)
+
+
+def write_feed(user):
+    return Recipe.objects.filter(feed_items__user=user)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает ленту подписок при чтении (read) и при записи '
+            '(write) для пользователей с наибольшим числом подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересобрать ленты перед замером')
+
+    def handle(self, *args, **options):
+        if options['rebuild'] or not FeedItem.objects.exists():
+            FeedItem.objects.rebuild()
+        users = list(User.objects.annotate(
+            subscriptions=Count('follower')).order_by(
+                '-subscriptions')[:options['users']])
+        if not users:
+            return
+        average = statistics.mean(user.subscriptions for user in users)
+        for name, feed in (('read', read_feed), ('write', write_feed)):
+            timings = []
+            for user in users:
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    self.walk(feed(user), options['pages'], options['limit'])
+                    timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            self.stdout.write(RESULT.format(
+                name, average, statistics.median(timings),
+                timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                options['pages']))
+
+    def walk(self, queryset, pages, limit):
+        """Проходит ленту по ключу, как KeysetPagination."""
+        last = None
+        for _ in range(pages):
+            page = queryset if last is None else queryset.filter(id__lt=last)
+            ids = list(page.order_by('-id').values_list(
+                'id', flat=True)[:limit])
+            if len(ids) < limit:
+                return
+            last = ids[-1]
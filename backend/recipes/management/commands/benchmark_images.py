@@ -0,0 +1,87 @@
+import base64
+import io
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from recipes.images import decode, make_variants
+
+DECODE = ('{:<8} медиана {:.2f} мс, p95 {:.2f} мс, '
+          'пик памяти {:.1f} МБ на картинку {:.1f} МБ')
+VARIANTS = '{:<2} потоков: {:.1f} картинок/с ({} картинок за {:.2f} с)'
+
+
+def make_image(width, height, number):
+    image = Image.effect_noise((width, height), 64 + number % 64)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def decode_whole(data):
+    """Старый способ: вся строка base64 декодируется в память разом."""
+    header, datastr = data.split(';base64,')
+    return io.BytesIO(base64.b64decode(datastr))
+
+
+def decode_chunked(data):
+    file, ext = decode(data)
+    file.close()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет декодирование загружаемых картинок и подготовку '
+            'вариантов в пуле потоков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20)
+        parser.add_argument('--width', type=int, default=3000)
+        parser.add_argument('--height', type=int, default=2000)
+        parser.add_argument(
+            '--workers', type=int, nargs='+', default=[1, 2, 4])
+
+    def handle(self, *args, **options):
+        images = [
+            make_image(options['width'], options['height'], number)
+            for number in range(options['count'])]
+        payloads = [
+            'data:image/jpeg;base64,' + base64.b64encode(image).decode()
+            for image in images]
+        size = statistics.mean(len(image) for image in images) / 2 ** 20
+        for name, function in (('whole', decode_whole),
+                               ('chunked', decode_chunked)):
+            timings, peaks = [], []
+            for payload in payloads:
+                tracemalloc.start()
+                start = time.perf_counter()
+                function(payload)
+                timings.append((time.perf_counter() - start) * 1000)
+                peaks.append(tracemalloc.get_traced_memory()[1] / 2 ** 20)
+                tracemalloc.stop()
+            timings.sort()
+            self.stdout.write(DECODE.format(
+                name, statistics.median(timings),
+                timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                max(peaks), size))
+        with tempfile.TemporaryDirectory() as directory:
+            storage = FileSystemStorage(location=directory)
+            for workers in options['workers']:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(
+                        lambda item: self.variants(storage, *item),
+                        enumerate(images)))
+                elapsed = time.perf_counter() - start
+                self.stdout.write(VARIANTS.format(
+                    workers, len(images) / elapsed, len(images), elapsed))
+
+    def variants(self, storage, number, data):
+        with Image.open(io.BytesIO(data)) as image:
+            make_variants(
+                image, 'recipes/images/{}.jpg'.format(number), storage)
@@ -0,0 +1,105 @@
+import re
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.cache import POPULAR
+from recipes.filters import RecipeFilter, TagsMode
+from recipes.models import (Cart, CartIngredient, Favorite, FeedItem,
+                            Recipe, Tag)
+from recipes.serializers import recipe_values
+from recipes.shopping_cart import cart_lines
+from recipes.views import RecipeViewSet, user_relations
+from users.models import User
+from users.views import user_subscriptions
+
+NO_DATA = 'Нет данных для проверки: нужны пользователь, рецепт и тег'
+SEQUENTIAL = 'Полный просмотр таблицы: {}'
+FAILED = 'Запросов с полным просмотром таблицы: {}'
+OK = 'ok    {}'
+BAD = 'SCAN  {}'
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)')
+SQLITE_SORT = 'TEMP B-TREE'
+PAGE = 6
+
+
+def get_queries(user, recipe, tag):
+    """Querysets, которые строят RecipeFilter, лента, favorite_or_cart,
+    subscribe и download_shopping_cart, на страницу из PAGE рецептов."""
+    request = SimpleNamespace(user=user)
+    view = RecipeViewSet(request=request, action='list')
+
+    def recipes(**data):
+        return recipe_values(RecipeFilter(
+            data, view.get_queryset(), request=request).qs)[:PAGE]
+
+    return {
+        'favorite by (user, recipe)': user_relations(
+            Favorite, user, (recipe.id,)).values('recipe_id'),
+        'cart by (user, recipe)': user_relations(
+            Cart, user, (recipe.id,)).values('recipe_id'),
+        'subscription by (user, author)': user_subscriptions(
+            user, (recipe.author_id,)).values('author_id'),
+        'subscribers by author': FeedItem.objects.subscribers(
+            recipe.author_id),
+        'recipes with user flags': recipes(),
+        'recipes by author': recipes(author=recipe.author_id),
+        'recipes by tag': recipes(tags=[tag.slug]),
+        'recipes by all tags': recipes(
+            tags=[tag.slug], tags_mode=TagsMode.ALL.value),
+        'popular recipes': recipes(ordering=POPULAR),
+        'recipes in favorites of user': recipes(is_favorited=1),
+        'recipes in cart of user': recipes(is_in_shopping_cart=1),
+        'feed': recipe_values(view.get_feed_queryset())[:PAGE],
+        'shopping cart download': cart_lines(
+            CartIngredient.objects.filter(user=user)),
+    }
+
+
+def sequential_scans(queryset, plan):
+    if connection.vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\w+)', plan)
+    if connection.vendor == 'sqlite':
+        scans = SQLITE_SCAN.findall(plan)
+        if queryset.query.high_mark is not None and SQLITE_SORT not in plan:
+            # Страница в порядке id: SQLite обходит rowid и останавливается
+            # на LIMIT, но пишет в плане тот же SCAN.
+            table = queryset.model._meta.db_table
+            scans = [scan for scan in scans if scan != table]
+        return scans
+    return []
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для частых запросов и завершается с ошибкой, '
+            'если какой-то из них просматривает таблицу целиком')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(follower__isnull=False).first()
+        recipe = Recipe.objects.first()
+        tag = Tag.objects.first()
+        if user is None or recipe is None or tag is None:
+            raise CommandError(NO_DATA)
+        failed = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Без индекса план всё равно останется Seq Scan.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in get_queries(user, recipe, tag).items():
+                plan = queryset.explain()
+                scans = sequential_scans(queryset, plan)
+                if scans:
+                    failed.append(name)
+                    self.stdout.write(BAD.format(name))
+                    self.stdout.write(SEQUENTIAL.format(', '.join(scans)))
+                else:
+                    self.stdout.write(OK.format(name))
+                if options['verbose_plans']:
+                    self.stdout.write(plan)
+        if failed:
+            raise CommandError(FAILED.format(len(failed)))
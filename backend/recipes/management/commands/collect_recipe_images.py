@@ -0,0 +1,94 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import SVG, process
+from recipes.models import Recipe
+
+VARIANTS_DIR = 'variants'
+RESULT = ('Файлов проверено: {}, удалено: {} ({:.1f} МБ), '
+          'оставлено недавних: {}')
+DRY_RUN = 'Пробный запуск, файлы не удалены'
+PENDING = 'Картинок без вариантов: {}, готово после обработки: {}'
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+def stem(name):
+    return os.path.basename(name).split('.')[0]
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов и их варианты, '
+            'на которые не ссылается ни один рецепт, и достраивает '
+            'варианты, потерянные пулом обработки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать файлы для удаления')
+
+    def handle(self, *args, **options):
+        self.process_pending(options['dry_run'])
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        root = field.upload_to.rstrip('/')
+        if not storage.exists(root):
+            return
+        checked, recent, originals, candidates = self.scan(storage, root)
+        deleted = size = 0
+        for start in range(0, len(candidates), options['batch_size']):
+            batch = candidates[start:start + options['batch_size']]
+            # Повторная проверка: рецепт мог сослаться на файл после обхода.
+            in_use = {stem(name) for name in Recipe.objects.filter(
+                image__in={originals.get(stem(name)) for name in batch}
+            ).values_list('image', flat=True)}
+            for name in batch:
+                if stem(name) in in_use:
+                    continue
+                size += storage.size(name)
+                deleted += 1
+                if not options['dry_run']:
+                    storage.delete(name)
+        if options['dry_run']:
+            self.stdout.write(DRY_RUN)
+        self.stdout.write(RESULT.format(
+            checked, deleted, size / 2 ** 20, recent))
+
+    def process_pending(self, dry_run):
+        """Обрабатывает картинки, задачи для которых не выполнились."""
+        ids = list(Recipe.objects.filter(image_ready=False).exclude(
+            image='').exclude(image__endswith='.' + SVG).values_list(
+                'id', flat=True))
+        if not dry_run:
+            for id in ids:
+                process(id)
+        self.stdout.write(PENDING.format(len(ids), Recipe.objects.filter(
+            id__in=ids, image_ready=True).count()))
+
+    def scan(self, storage, root):
+        """Находит файлы без ссылок, кроме загруженных недавно."""
+        referenced = {
+            stem(name) for name in Recipe.objects.values_list(
+                'image', flat=True).iterator()}
+        originals = {}
+        candidates = []
+        checked = recent = 0
+        for name in walk(storage, root):
+            checked += 1
+            if os.path.basename(os.path.dirname(name)) != VARIANTS_DIR:
+                originals[stem(name)] = name
+            if stem(name) in referenced:
+                continue
+            if storage.is_recent(name):
+                recent += 1
+                continue
+            candidates.append(name)
+        return checked, recent, originals, candidates
@@ -0,0 +1,33 @@
+import sys
+import zipfile
+
+from django.core.management.base import BaseCommand
+
+from recipes.bulk import export_recipes
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты в NDJSON в формате import_recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл NDJSON, - для stdout')
+        parser.add_argument(
+            '--images', help='Записать картинки в zip-архив, а не в data URI')
+        parser.add_argument('--author', help='Только рецепты автора')
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.all()
+        if options['author']:
+            queryset = queryset.filter(author__username=options['author'])
+        archive = options['images'] and zipfile.ZipFile(
+            options['images'], 'w', zipfile.ZIP_STORED)
+        file = (sys.stdout if options['path'] == '-'
+                else open(options['path'], 'w', encoding='utf-8'))
+        try:
+            file.writelines(export_recipes(queryset, archive))
+        finally:
+            if file is not sys.stdout:
+                file.close()
+            if archive:
+                archive.close()
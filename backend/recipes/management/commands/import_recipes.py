@@ -0,0 +1,44 @@
+import json
+import sys
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.bulk import BATCH_SIZE, RecipeImporter
+from users.models import User
+
+AUTHOR_NOT_FOUND = 'Пользователь {} не существует'
+ROW_ERROR = 'Строка {}: {}'
+RESULT = 'Добавлено рецептов: {}, строк с ошибками: {}'
+
+
+class Command(BaseCommand):
+    help = ('Импортирует рецепты из NDJSON, картинки — data URI '
+            'или файлы из zip-архива')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл NDJSON, - для stdin')
+        parser.add_argument('--images', help='Zip-архив с картинками')
+        parser.add_argument(
+            '--author', help='Автор всех рецептов вместо поля author')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(AUTHOR_NOT_FOUND.format(options['author']))
+        archive = options['images'] and zipfile.ZipFile(options['images'])
+        importer = RecipeImporter(author, archive, options['batch_size'])
+        if options['path'] == '-':
+            report = importer.run(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8') as file:
+                report = importer.run(file)
+        for error in report['errors']:
+            self.stderr.write(ROW_ERROR.format(
+                error['line'], json.dumps(error['errors'],
+                                          ensure_ascii=False)))
+        self.stdout.write(RESULT.format(
+            report['created'], len(report['errors'])))
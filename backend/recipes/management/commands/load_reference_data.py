@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from recipes.cache import (ALL, INGREDIENTS, LISTS, TAGS, bump_version,
+                           evict_lists_on_commit, touch_on_commit)
+from recipes.models import Ingredient, Recipe, Tag
+
+DATA_DIR = os.path.join(settings.BASE_DIR, 'data')
+# Модель, поле-ключ, поля в порядке столбцов CSV, версия кеша и связь
+# рецепта с моделью.
+SOURCES = {
+    'ingredients': (Ingredient, 'name', ('name', 'measurement_unit'),
+                    INGREDIENTS, 'ingredients'),
+    'tags': (Tag, 'slug', ('name', 'color', 'slug'), TAGS, 'tags'),
+}
+WRONG_ROW = '{}, строка {}: ожидались поля {}'
+WRONG_FORMAT = '{}: поддерживаются файлы .csv, .json и .jsonl'
+CONFLICT = '{}: {}'
+CONFLICT_ROW = '{}: запись «{}» совпадает по полю «{}» с записью «{}»'
+RESULT = '{}: добавлено {}, обновлено {}, без изменений {}'
+
+
+def read_csv(file, fields):
+    for row in csv.reader(file):
+        yield dict(zip(fields, row)) if len(row) == len(fields) else None
+
+
+def read_json(file, fields):
+    yield from json.load(file)
+
+
+def read_jsonl(file, fields):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {'.csv': read_csv, '.json': read_json, '.jsonl': read_jsonl}
+
+
+class Command(BaseCommand):
+    help = ('Загружает теги и ингредиенты из CSV или JSON: добавляет новые '
+            'и обновляет изменённые записи пакетами')
+
+    def add_arguments(self, parser):
+        for name in SOURCES:
+            parser.add_argument(
+                '--{}'.format(name),
+                default=os.path.join(DATA_DIR, '{}.csv'.format(name)),
+                help='Путь к файлу, пустая строка — не загружать')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                for name, source in SOURCES.items():
+                    if options[name]:
+                        self.load(options[name], options['batch_size'],
+                                  *source)
+        except IntegrityError as error:
+            raise CommandError(CONFLICT.format(name, error))
+
+    def load(self, path, batch_size, model, key, fields, version,
+             relation):
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError(WRONG_FORMAT.format(path))
+        inserted = updated = skipped = 0
+        with open(path, encoding='utf-8') as file:
+            rows = enumerate(reader(file, fields), 1)
+            for batch in iter(lambda: list(islice(rows, batch_size)), []):
+                created, changed = self.upsert(
+                    self.clean(path, batch, fields, key), model, key, fields)
+                inserted += created
+                updated += len(changed)
+                skipped += len(batch) - created - len(changed)
+                # Рецепты показывают названия тегов и ингредиентов.
+                Recipe.objects.filter(**{relation + '__in': changed}).update(
+                    modified=timezone.now())
+        if inserted or updated:
+            # Массовые операции не посылают сигналы, версию меняем сами.
+            bump_version(version)
+            evict_lists_on_commit(ALL)
+            touch_on_commit(LISTS)
+        self.stdout.write(RESULT.format(
+            model._meta.verbose_name_plural, inserted, updated, skipped))
+
+    def clean(self, path, batch, fields, key):
+        """Проверяет строки пакета, повторы ключа оставляет последними."""
+        rows = {}
+        for number, row in batch:
+            if not isinstance(row, dict) or any(
+                    not isinstance(row.get(field), str) or not row[field]
+                    for field in fields):
+                raise CommandError(
+                    WRONG_ROW.format(path, number, ', '.join(fields)))
+            rows[row[key].strip()] = {
+                field: row[field].strip() for field in fields}
+        return rows
+
+    def upsert(self, rows, model, key, fields):
+        existing = model.objects.in_bulk(list(rows), field_name=key)
+        changed = []
+        for value, obj in existing.items():
+            row = rows.pop(value)
+            if any(getattr(obj, field) != row[field] for field in fields):
+                for field in fields:
+                    setattr(obj, field, row[field])
+                changed.append(obj)
+        try:
+            with transaction.atomic():
+                model.objects.bulk_update(
+                    changed, [field for field in fields if field != key])
+                # Без ignore_conflicts: пропущенная строка не должна
+                # считаться добавленной.
+                model.objects.bulk_create(
+                    [model(**row) for row in rows.values()])
+        except IntegrityError:
+            self.raise_conflict(model, key, fields, [
+                {field: getattr(obj, field) for field in fields}
+                for obj in changed] + list(rows.values()))
+            raise
+        return len(rows), changed
+
+    def raise_conflict(self, model, key, fields, rows):
+        """Называет строку, которая повторяет уникальное поле другой
+        записи в файле или в базе."""
+        for field in fields:
+            if field == key or not model._meta.get_field(field).unique:
+                continue
+            owners = dict(model.objects.filter(
+                **{field + '__in': [row[field] for row in rows]}
+            ).values_list(field, key))
+            for row in rows:
+                owner = owners.setdefault(row[field], row[key])
+                if owner != row[key]:
+                    raise CommandError(CONFLICT_ROW.format(
+                        model._meta.verbose_name_plural, row[key],
+                        model._meta.get_field(field).verbose_name, owner))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import CartIngredient
+
+DIFFERENCE = 'Пользователь {}, ингредиент {}: сохранено {}, должно быть {}'
+CHECKED = 'Расхождений: {}'
+REBUILT = 'Итоги списков покупок пересчитаны: {} строк'
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает и проверяет итоги списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сравнить сохранённые итоги с пересчитанными')
+
+    def handle(self, *args, **options):
+        totals = {(user, ingredient): total for user, ingredient, total
+                  in CartIngredient.objects.calculate().iterator()}
+        if options['check']:
+            self.check_totals(totals)
+            return
+        with transaction.atomic():
+            CartIngredient.objects.all().delete()
+            CartIngredient.objects.bulk_create(
+                (CartIngredient(user_id=user, ingredient_id=ingredient,
+                                amount=total)
+                 for (user, ingredient), total in totals.items()))
+        self.stdout.write(self.style.SUCCESS(REBUILT.format(len(totals))))
+
+    def check_totals(self, totals):
+        stored = {(user, ingredient): amount for user, ingredient, amount
+                  in CartIngredient.objects.values_list(
+                      'user', 'ingredient', 'amount').iterator()}
+        keys = sorted(stored.keys() | totals.keys())
+        differences = 0
+        for key in keys:
+            if stored.get(key) != totals.get(key):
+                differences += 1
+                self.stdout.write(DIFFERENCE.format(
+                    *key, stored.get(key), totals.get(key)))
+        if differences:
+            raise CommandError(CHECKED.format(differences))
+        self.stdout.write(self.style.SUCCESS(CHECKED.format(differences)))
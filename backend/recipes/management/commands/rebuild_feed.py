@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedItem
+
+REBUILT = 'Ленты подписок пересобраны: {} записей'
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок для FEED_STRATEGY = write'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            FeedItem.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            REBUILT.format(FeedItem.objects.count())))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.cache import HIT, MISS, get_stats
+
+STATS = 'Попаданий: {}, промахов: {}, доля попаданий: {:.1%}'
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша ответов рецептов'
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = stats[HIT] + stats[MISS]
+        self.stdout.write(STATS.format(
+            stats[HIT], stats[MISS], stats[HIT] / total if total else 0))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Cart, Favorite, Recipe
+
+RECONCILED = 'Исправлены счётчики у рецептов: {}'
+
+
+def count_rows(model):
+    return Coalesce(Subquery(model.objects.filter(
+        recipe=OuterRef('pk')).order_by().values('recipe').annotate(
+            total=Count('id')).values('total')), 0)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет favorites_count и in_carts_count рецептов с таблицами '
+            'избранного и корзин и исправляет расхождения')
+
+    def handle(self, *args, **options):
+        wrong = Recipe.objects.annotate(
+            favorites_total=count_rows(Favorite),
+            carts_total=count_rows(Cart),
+        ).filter(
+            ~Q(favorites_count=F('favorites_total'))
+            | ~Q(in_carts_count=F('carts_total'))
+        ).values_list('id', flat=True)
+        updated = Recipe.objects.filter(id__in=list(wrong)).update(
+            favorites_count=count_rows(Favorite),
+            in_carts_count=count_rows(Cart))
+        self.stdout.write(self.style.SUCCESS(RECONCILED.format(updated)))
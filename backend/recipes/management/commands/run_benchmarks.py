@@ -0,0 +1,304 @@
+import base64
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from foodgram.fastjson import FastJSONParser, FastJSONRenderer
+from recipes.images import to_file
+from recipes.models import Cart, Ingredient, Recipe, Tag
+from recipes.serializers import RecipeReader, RecipeSerializer, recipe_values
+from recipes.views import RecipeViewSet
+from users.models import Subscription, User
+
+from .seed_benchmark_data import PREFIX
+
+NO_DATA = 'Нет данных для замеров, запустите seed_benchmark_data'
+READER_DIFFERS = 'RecipeReader и RecipeSerializer дали разный JSON на {}'
+HEADER = '{:<28} {:>6} {:>9} {:>9} {:>9} {:>8}'
+ROW = '{:<28} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.1f}'
+PEAK = '{:<28} пик памяти {:.1f} МБ'
+PAGE_SIZES = (6, 50, 500)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def summarize(samples):
+    timings = [timing for timing, queries in samples]
+    queries = [queries for timing, queries in samples]
+    return {
+        'count': len(samples),
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'queries_mean': statistics.mean(queries),
+        'queries_max': max(queries),
+    }
+
+
+def measure(function):
+    """Время вызова в миллисекундах и число запросов к базе."""
+    with CaptureQueriesContext(connections['default']) as context:
+        start = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, len(context)
+
+
+def peak_memory(function):
+    """Пик памяти Python за вызов в мегабайтах."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def upload_body():
+    """Тело POST /api/recipes/ с картинкой PNG из шума, около 3 МБ base64."""
+    buffer = io.BytesIO()
+    size = (1024, 768)
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(
+        buffer, 'PNG')
+    return json.dumps({
+        'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+        'tags': [1], 'ingredients': [{'id': 1, 'amount': 10}],
+        'image': 'data:image/png;base64,' + base64.b64encode(
+            buffer.getvalue()).decode(),
+    }).encode()
+
+
+def upload(parser, body):
+    data = parser.parse(io.BytesIO(body), 'application/json', {})
+    to_file(data['image'], 'benchmark').close()
+
+
+def consume(response):
+    if response.status_code >= 400:
+        raise CommandError('{} {}'.format(
+            response.status_code, response.content[:200]))
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+
+class Command(BaseCommand):
+    help = ('Микробенчмарки горячих мест API и нагрузочный сценарий по '
+            'RecipeViewSet и UserViewSet на данных seed_benchmark_data, '
+            'результат p50/p95/p99 и число запросов в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30,
+                            help='Повторов каждого микробенчмарка')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Запросов в нагрузочном сценарии')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--suite', choices=('all', 'micro', 'load'), default='all')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.tokens = list(Token.objects.filter(
+            user__username__startswith=PREFIX).values_list('key', flat=True))
+        self.recipes = list(Recipe.objects.values_list('id', flat=True))
+        self.users = list(User.objects.filter(
+            username__startswith=PREFIX).values_list('id', flat=True))
+        if not self.tokens or not self.recipes:
+            raise CommandError(NO_DATA)
+        results = {'meta': self.meta(options)}
+        if options['suite'] in ('all', 'micro'):
+            results['micro'] = self.micro(options['repeat'])
+        if options['suite'] in ('all', 'load'):
+            results['load'] = self.load(
+                options['requests'], options['concurrency'])
+        for suite in ('micro', 'load'):
+            if suite in results:
+                self.report(suite, results[suite])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def meta(self, options):
+        return {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'feed_strategy': settings.FEED_STRATEGY,
+            'options': {key: options[key] for key in (
+                'repeat', 'requests', 'concurrency', 'seed', 'suite')},
+            'data': {
+                'users': User.objects.count(),
+                'recipes': len(self.recipes),
+                'ingredients': Ingredient.objects.count(),
+                'carts': Cart.objects.count(),
+                'subscriptions': Subscription.objects.count(),
+            },
+        }
+
+    def client(self, token=None):
+        client = APIClient()
+        token = token or self.random.choice(self.tokens)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+    def micro(self, repeat):
+        token = Token.objects.filter(user__in=Cart.objects.values(
+            'user')).select_related('user').first()
+        client = self.client(token.key)
+        user = token.user
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        benchmarks = {}
+        for size in PAGE_SIZES:
+            if (JSONRenderer().render(self.page(user, size))
+                    != JSONRenderer().render(self.page(user, size, True))):
+                raise CommandError(READER_DIFFERS.format(size))
+            benchmarks['serializer_list_{}'.format(size)] = (
+                lambda size=size: self.page(user, size))
+            benchmarks['reader_list_{}'.format(size)] = (
+                lambda size=size: self.page(user, size, True))
+        benchmarks.update(self.json_benchmarks(user))
+        for format in ('txt', 'pdf'):
+            benchmarks['download_shopping_cart_' + format] = (
+                lambda format=format: consume(client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': format})))
+        benchmarks['subscriptions'] = lambda: consume(client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 3}))
+        benchmarks['ingredient_search'] = lambda: consume(client.get(
+            '/api/ingredients/',
+            {'name': self.random.choice(names)[:self.random.randint(1, 4)]}))
+        results = {}
+        for name, function in benchmarks.items():
+            function()
+            results[name] = summarize(
+                [measure(function) for _ in range(repeat)])
+            if name.startswith('upload_'):
+                results[name]['peak_mb'] = peak_memory(function)
+        return results
+
+    def json_benchmarks(self, user):
+        """Рендеринг страницы рецептов и разбор загрузки картинки.
+
+        Стандартные JSONRenderer и JSONParser против классов на orjson.
+        """
+        data = self.page(user, PAGE_SIZES[-1], True)
+        body = upload_body()
+        benchmarks = {}
+        for name, renderer, parser in (
+                ('stdlib', JSONRenderer(), JSONParser()),
+                ('fast', FastJSONRenderer(), FastJSONParser())):
+            benchmarks['render_{}_{}'.format(name, PAGE_SIZES[-1])] = (
+                lambda renderer=renderer: renderer.render(data))
+            benchmarks['upload_' + name] = (
+                lambda parser=parser: upload(parser, body))
+        return benchmarks
+
+    def page(self, user, size, reader=False):
+        """Данные страницы рецептов без HTTP, через RecipeReader или DRF."""
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        view = RecipeViewSet(request=request, action='list',
+                             format_kwarg=None)
+        queryset = view.get_queryset()
+        serializer = RecipeSerializer
+        if reader:
+            queryset = recipe_values(queryset)
+            serializer = RecipeReader
+        return serializer(queryset[:size], many=True,
+                          context={'request': request, 'view': view}).data
+
+    def scenarios(self):
+        tags = list(Tag.objects.values_list('slug', flat=True))
+        return (
+            ('recipes_list', lambda: ('/api/recipes/', {'limit': 6})),
+            ('recipes_list_page', lambda: ('/api/recipes/', {
+                'limit': 6, 'page': self.random.randint(1, 5)})),
+            ('recipes_tags', lambda: ('/api/recipes/', {
+                'tags': self.random.sample(tags, min(2, len(tags)))})),
+            ('recipes_favorited', lambda: (
+                '/api/recipes/', {'is_favorited': 1})),
+            ('recipes_popular', lambda: (
+                '/api/recipes/', {'ordering': 'popular'})),
+            ('recipes_feed', lambda: ('/api/recipes/feed/', {})),
+            ('recipe_detail', lambda: ('/api/recipes/{}/'.format(
+                self.random.choice(self.recipes)), {})),
+            ('users_list', lambda: ('/api/users/', {'limit': 6})),
+            ('users_me', lambda: ('/api/users/me/', {})),
+            ('user_detail', lambda: ('/api/users/{}/'.format(
+                self.random.choice(self.users)), {})),
+            ('users_subscriptions', lambda: (
+                '/api/users/subscriptions/', {'recipes_limit': 3})),
+        )
+
+    def load(self, requests, concurrency):
+        """Случайная смесь запросов от разных пользователей в потоках."""
+        scenarios = self.scenarios()
+        plan = [self.random.choice(scenarios) for _ in range(requests)]
+        samples = defaultdict(list)
+        lock = threading.Lock()
+
+        def worker(part):
+            client = self.client()
+            try:
+                for name, arguments in part:
+                    path, params = arguments()
+                    sample = measure(
+                        lambda: consume(client.get(path, params)))
+                    with lock:
+                        samples[name].append(sample)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(
+            plan[number::concurrency],)) for number in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results = {name: summarize(values)
+                   for name, values in sorted(samples.items())}
+        results['total'] = dict(summarize(
+            [sample for values in samples.values() for sample in values]),
+            rps=requests / elapsed)
+        return results
+
+    def report(self, suite, results):
+        self.stdout.write(HEADER.format(
+            suite, 'n', 'p50, мс', 'p95, мс', 'p99, мс', 'запросы'))
+        for name, stats in results.items():
+            self.stdout.write(ROW.format(
+                name, stats['count'], stats['p50'], stats['p95'],
+                stats['p99'], stats['queries_mean']))
+        for name, stats in results.items():
+            if 'peak_mb' in stats:
+                self.stdout.write(PEAK.format(name, stats['peak_mb']))
@@ -0,0 +1,129 @@
+import io
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.bulk import RecipeImporter
+from recipes.models import (Cart, Favorite, FeedItem, Ingredient, Recipe,
+                            Tag)
+from users.models import Subscription, User
+
+PREFIX = 'bench_'
+PASSWORD = 'benchmark-password'
+BATCH_SIZE = 1000
+SEEDED = ('Создано пользователей: {}, рецептов: {}, избранного: {}, '
+          'корзин: {}, подписок: {}')
+CLEARED = 'Удалены пользователи bench_* и их данные: {}'
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), '#E26C2D').save(buffer, 'JPEG')
+    return ContentFile(buffer.getvalue(), name='benchmark.jpg')
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу пользователями bench_*, рецептами, избранным, '
+            'корзинами и подписками для замеров производительности')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=10,
+                            help='Рецептов на пользователя')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--carts', type=int, default=10,
+                            help='Рецептов в корзине на пользователя')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок на пользователя')
+        parser.add_argument('--ingredients', type=int, default=8,
+                            help='Ингредиентов в рецепте')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить пользователей bench_* перед заполнением')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = User.objects.filter(
+                username__startswith=PREFIX).delete()
+            self.stdout.write(CLEARED.format(deleted))
+        call_command('load_reference_data', stdout=self.stdout)
+        random.seed(options['seed'])
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, options)
+            favorites = self.relate(Favorite, users, recipes,
+                                    options['favorites'])
+            carts = self.relate(Cart, users, recipes, options['carts'])
+            subscriptions = self.subscribe(users, options['subscriptions'])
+        call_command('reconcile_recipe_counters', stdout=self.stdout)
+        call_command('rebuild_cart_totals', stdout=self.stdout)
+        if FeedItem.objects.enabled():
+            call_command('rebuild_feed', stdout=self.stdout)
+        self.stdout.write(SEEDED.format(
+            len(users), len(recipes), favorites, carts, subscriptions))
+
+    def create_users(self, count):
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (User(username='{}{}'.format(PREFIX, number),
+                  email='{}{}@example.com'.format(PREFIX, number),
+                  first_name='Bench', last_name=str(number),
+                  password=password)
+             for number in range(start, start + count)))
+        users = list(User.objects.filter(
+            username__startswith=PREFIX).order_by('-id')[:count])
+        Token.objects.bulk_create(
+            (Token(key=Token.generate_key(), user=user) for user in users),
+            ignore_conflicts=True)
+        return users
+
+    def create_recipes(self, users, options):
+        field = Recipe._meta.get_field('image')
+        image = field.storage.save(
+            field.generate_filename(None, 'benchmark.jpg'), make_image())
+        tags = list(Tag.objects.values_list('id', flat=True))
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        importer = RecipeImporter()
+        recipes = []
+        for user in users:
+            for number in range(options['recipes']):
+                recipe = Recipe(
+                    author=user, name='Рецепт {} {}'.format(user.id, number),
+                    text='Описание рецепта', image=image,
+                    cooking_time=random.randint(5, 120))
+                recipe.tag_ids = random.sample(
+                    tags, random.randint(1, len(tags)))
+                recipe.amounts = {
+                    id: random.randint(1, 500) for id in random.sample(
+                        ingredients, options['ingredients'])}
+                recipes.append(recipe)
+        for start in range(0, len(recipes), BATCH_SIZE):
+            importer.write(recipes[start:start + BATCH_SIZE])
+        return [recipe.id for recipe in recipes]
+
+    def relate(self, model, users, recipes, count):
+        objects = [model(user=user, recipe_id=recipe) for user in users
+                   for recipe in random.sample(
+                       recipes, min(count, len(recipes)))]
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        return len(objects)
+
+    def subscribe(self, users, count):
+        objects = []
+        for user in users:
+            authors = random.sample(users, min(count + 1, len(users)))
+            objects.extend(
+                Subscription(user=user, author=author)
+                for author in [author for author in authors
+                               if author != user][:count])
+        Subscription.objects.bulk_create(objects, ignore_conflicts=True)
+        return len(objects)
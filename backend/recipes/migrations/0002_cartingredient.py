@@ -0,0 +1,43 @@
+# Generated by Django 2.2.27 on 2026-10-18 17:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_cart_ingredients(apps, schema_editor):
+    CartIngredient = apps.get_model('recipes', 'CartIngredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    totals = RecipeIngredient.objects.filter(
+        recipe__shopping_cart__isnull=False).values_list(
+            'recipe__shopping_cart__user', 'ingredient').annotate(
+                total=Sum('amount')).order_by()
+    CartIngredient.objects.bulk_create(
+        CartIngredient(user_id=user, ingredient_id=ingredient, amount=total)
+        for user, ingredient, total in totals.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to='recipes.Ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cart_ingredient'),
+        ),
+        migrations.RunPython(fill_cart_ingredients, migrations.RunPython.noop),
+    ]
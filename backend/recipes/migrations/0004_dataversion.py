@@ -0,0 +1,33 @@
+# Generated by Django 2.2.27 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+NAMES = ('tags', 'ingredients')
+
+
+def create_versions(apps, schema_editor):
+    DataVersion = apps.get_model('recipes', 'DataVersion')
+    DataVersion.objects.bulk_create(DataVersion(name=name) for name in NAMES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Справочник')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.27 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Варианты картинки готовы'),
+        ),
+    ]
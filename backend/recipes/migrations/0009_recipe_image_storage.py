@@ -0,0 +1,19 @@
+# Generated by Django 2.2.27 on 2026-10-18 17:21
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.HashedImageStorage(), upload_to='recipes/images/', verbose_name='Картинка'),
+        ),
+    ]
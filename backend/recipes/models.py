@@ -1,8 +1,13 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 
-from users.models import User
+from users.models import Subscription, User, lock_users
+from .storage import HashedImageStorage
 from .validators import validate_amount, validate_time
 
+FAN_OUT_ON_READ = 'read'
+FAN_OUT_ON_WRITE = 'write'
+
 
 class Tag(models.Model):
     name = models.CharField('Название тега', unique=True, max_length=200)
@@ -18,6 +23,19 @@ class Tag(models.Model):
         return self.name
 
 
+class DataVersion(models.Model):
+    """Версия справочника, увеличивается при каждом его изменении."""
+    name = models.CharField('Справочник', unique=True, max_length=50)
+    version = models.PositiveIntegerField('Версия', default=0)
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return '{} v{}'.format(self.name, self.version)
+
+
 class Ingredient(models.Model):
     name = models.CharField('Название', unique=True, max_length=200)
     measurement_unit = models.CharField('Единица измерения', max_length=200)
@@ -34,7 +52,10 @@ class Ingredient(models.Model):
 class Recipe(models.Model):
     name = models.CharField('Название', max_length=200)
     text = models.TextField('Описание', max_length=200)
-    image = models.ImageField('Картинка', upload_to='recipes/images/')
+    image = models.ImageField(
+        'Картинка', upload_to='recipes/images/', storage=HashedImageStorage())
+    image_ready = models.BooleanField(
+        'Варианты картинки готовы', default=False, editable=False)
     cooking_time = models.IntegerField(
         'Время приготовления (в минутах)', validators=[validate_time])
     tags = models.ManyToManyField(
@@ -45,9 +66,21 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField(
         Ingredient, related_name='recipes', through='RecipeIngredient',
         verbose_name='Ингредиенты')
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False)
+    created = models.DateTimeField('Создан', auto_now_add=True)
+    modified = models.DateTimeField('Изменён', auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['author', '-id'],
+                         name='recipe_author_id_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_popular_idx'),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -62,6 +95,8 @@ class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
 
     class Meta:
+        indexes = [models.Index(fields=['recipe', 'ingredient', 'amount'],
+                                name='recipeingredient_cover_idx')]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -79,6 +114,8 @@ class Favorite(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'], name='unique_favorite')
         ]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='favorite_recipe_user_idx')]
 
 
 class Cart(models.Model):
@@ -91,3 +128,125 @@ class Cart(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'], name='unique_cart')
         ]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='cart_recipe_user_idx')]
+
+
+class CartIngredientManager(models.Manager):
+    def apply(self, users, amounts):
+        """Прибавляет количества ингредиентов к спискам покупок.
+
+        users - id пользователей, amounts - словарь {id ингредиента:
+        изменение количества}. Строки с нулевым количеством удаляются.
+        """
+        amounts = {id: amount for id, amount in amounts.items() if amount}
+        users = list(users)
+        if not users or not amounts:
+            return
+        with transaction.atomic():
+            # Списки покупок одного пользователя меняются по очереди.
+            lock_users(users)
+            rows = list(self.filter(
+                user_id__in=users, ingredient_id__in=amounts))
+            existing = set()
+            for row in rows:
+                row.amount += amounts[row.ingredient_id]
+                existing.add((row.user_id, row.ingredient_id))
+            self.bulk_update(rows, ('amount',))
+            self.bulk_create(
+                self.model(user_id=user, ingredient_id=id, amount=amount)
+                for user in users for id, amount in amounts.items()
+                if (user, id) not in existing and amount > 0)
+            self.filter(user_id__in=users, amount__lte=0).delete()
+
+    def recipes_amounts(self, recipes, sign=1):
+        """Суммы ингредиентов рецептов {id ингредиента: количество}."""
+        totals = RecipeIngredient.objects.filter(
+            recipe__in=recipes).values_list('ingredient_id').annotate(
+                total=models.Sum('amount')).order_by()
+        return {id: sign * total for id, total in totals}
+
+    def add_recipes(self, users, recipes):
+        self.apply(users, self.recipes_amounts(recipes))
+
+    def remove_recipes(self, users, recipes):
+        self.apply(users, self.recipes_amounts(recipes, -1))
+
+    def change_recipe(self, recipe, amounts):
+        self.apply(Cart.objects.filter(recipe=recipe).values_list(
+            'user_id', flat=True), amounts)
+
+    def calculate(self):
+        """Итоги списков покупок, посчитанные заново по корзинам."""
+        return RecipeIngredient.objects.filter(
+            recipe__shopping_cart__isnull=False).values_list(
+                'recipe__shopping_cart__user', 'ingredient').annotate(
+                    total=models.Sum('amount')).order_by()
+
+
+class CartIngredient(models.Model):
+    """Итоговое количество ингредиента в списке покупок пользователя."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='cart_ingredients')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   related_name='cart_ingredients')
+    amount = models.IntegerField('Количество')
+
+    objects = CartIngredientManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'], name='unique_cart_ingredient')
+        ]
+
+
+class FeedItemManager(models.Manager):
+    def enabled(self):
+        """Ленты заполняются при записи (FEED_STRATEGY = 'write')."""
+        return settings.FEED_STRATEGY == FAN_OUT_ON_WRITE
+
+    def subscribers(self, author_id):
+        return Subscription.objects.filter(author_id=author_id).values_list(
+            'user_id', flat=True)
+
+    def fan_out(self, recipe):
+        """Добавляет новый рецепт в ленты подписчиков автора."""
+        self.bulk_create(
+            (self.model(user_id=user, recipe=recipe,
+                        author_id=recipe.author_id)
+             for user in self.subscribers(recipe.author_id).iterator()),
+            ignore_conflicts=True)
+
+    def subscribe(self, user, authors):
+        self.bulk_create(
+            (self.model(user=user, recipe_id=recipe, author_id=author)
+             for recipe, author in Recipe.objects.filter(
+                 author__in=authors).values_list(
+                     'id', 'author_id').iterator()),
+            ignore_conflicts=True)
+
+    def unsubscribe(self, user, authors):
+        self.filter(user=user, author__in=authors).delete()
+
+    def rebuild(self):
+        self.all().delete()
+        for user, author in Subscription.objects.values_list(
+                'user_id', 'author_id').iterator():
+            self.subscribe(User(id=user), (author,))
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписок пользователя (заполняется при записи)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='feed_items')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='feed_items')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+
+    objects = FeedItemManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'recipe'], name='unique_feed_item')
+        ]
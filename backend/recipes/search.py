@@ -0,0 +1,140 @@
+import heapq
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+from .cache import INGREDIENTS, get_version
+from .models import Ingredient
+
+TRIGRAM_THRESHOLD = 0.3
+WORD = re.compile(r'\w+')
+
+_index = None
+
+
+def trigrams(text):
+    """Триграммы строки по правилам расширения pg_trgm."""
+    result = set()
+    for word in WORD.findall(text.lower()):
+        word = '  {} '.format(word)
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def substrings(text):
+    """Подстроки длиной до трёх символов для поиска по вхождению."""
+    return {text[i:i + size] for size in (1, 2, 3)
+            for i in range(len(text) - size + 1)}
+
+
+def similarity(first, second):
+    if not first or not second:
+        return 0
+    return len(first & second) / len(first | second)
+
+
+class IngredientIndex:
+    """Префиксное дерево и триграммы названий ингредиентов в памяти.
+
+    Обратный индекс от триграмм и коротких подстрок к id отбирает
+    кандидатов, оценивается только их похожесть.
+    """
+
+    def __init__(self, rows):
+        self.root = {'children': {}, 'ids': []}
+        self.names = {}
+        self.trigrams = {}
+        self.index = defaultdict(set)
+        for id, name in sorted(rows, key=lambda row: row[1].lower()):
+            name = name.lower()
+            self.names[id] = name
+            self.trigrams[id] = trigrams(name)
+            for gram in self.trigrams[id] | substrings(name):
+                self.index[gram].add(id)
+            node = self.root
+            for char in name:
+                node = node['children'].setdefault(
+                    char, {'children': {}, 'ids': []})
+                node['ids'].append(id)
+
+    def prefix(self, query):
+        node = self.root
+        for char in query:
+            node = node['children'].get(char)
+            if node is None:
+                return []
+        return node['ids']
+
+    def candidates(self, query, query_trigrams):
+        """id с общей триграммой или началом запроса в подстроке."""
+        ids = set(self.index.get(query[:3], ()))
+        for gram in query_trigrams:
+            ids.update(self.index.get(gram, ()))
+        return ids
+
+    def search(self, query, limit):
+        query = query.lower()
+        query_trigrams = trigrams(query)
+        prefix = set(self.prefix(query))
+        ranked = []
+        for id in prefix | self.candidates(query, query_trigrams):
+            name = self.names[id]
+            score = similarity(query_trigrams, self.trigrams[id])
+            if id in prefix:
+                ranked.append((0, -score, name, id))
+            elif query in name or score > TRIGRAM_THRESHOLD:
+                ranked.append((1, -score, name, id))
+        return [id for *key, id in heapq.nsmallest(limit, ranked)]
+
+
+def get_index():
+    """Индекс, перестраиваемый при смене версии справочника."""
+    global _index
+    version = get_version(INGREDIENTS)
+    if _index is None or _index[0] != version:
+        _index = (version, IngredientIndex(
+            Ingredient.objects.values_list('id', 'name').iterator()))
+    return _index[1]
+
+
+def use_trigram_index():
+    backend = getattr(settings, 'INGREDIENT_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return connection.vendor == 'postgresql'
+    return backend == 'postgresql'
+
+
+def search_trigram(queryset, query, limit):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    query = query.upper()
+    return queryset.annotate(
+        upper_name=Upper('name'),
+        similarity=TrigramSimilarity(Upper('name'), query),
+    ).filter(
+        Q(upper_name__contains=query) | Q(upper_name__trigram_similar=query)
+    ).annotate(
+        rank=Case(When(upper_name__startswith=query, then=Value(0)),
+                  default=Value(1), output_field=IntegerField())
+    ).order_by('rank', '-similarity', 'name')[:limit]
+
+
+def search_index(queryset, query, limit):
+    ids = get_index().search(query, limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).order_by(Case(
+        *[When(id=id, then=Value(position))
+          for position, id in enumerate(ids)],
+        output_field=IntegerField()))
+
+
+def search(queryset, query, limit):
+    """Ингредиенты по началу названия, подстроке и похожести."""
+    if use_trigram_index():
+        return search_trigram(queryset, query, limit)
+    return search_index(queryset, query, limit)
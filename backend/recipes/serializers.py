@@ -1,12 +1,16 @@
-import base64
 import uuid
+from collections import defaultdict
 
-from django.core.files.base import ContentFile
-from django.shortcuts import get_list_or_404
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import serializers
 
+from users.models import Subscription, User
 from users.serializers import UserSerializer
-from .models import Cart, Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+from .images import (CARD, FULL, THUMBNAIL, RecipeImageField, image_url,
+                     release_on_commit, schedule, to_file)
+from .models import (Cart, CartIngredient, Favorite, Ingredient, Recipe,
+                     RecipeIngredient, Tag)
 
 INGREDIENS_KEY_ERROR = 'Поле ingredients обязательно'
 INGREDIENT_NOT_CORRECT = 'Каждый ингредиент должен содержать поля : id, amount'
@@ -17,6 +21,22 @@ TAG_NOT_FOUND = 'Тег с id = {} не существует'
 CHECK_TIME = 'Время приготовления должно быть больше нуля'
 CHECK_AMOUNT = 'Ингредиент {}: Количество должно быть больше нуля'
 CHECK_AMOUNT_FORMAT = 'Ингредиент {}: Введите правильное число'
+BATCH_LIMIT = 100
+CARD_ACTIONS = ('list', 'feed')
+
+RECIPE_VALUES = ('id', 'name', 'text', 'cooking_time', 'image', 'image_ready',
+                 'author_id', 'favorites_count')
+RECIPE_ANNOTATIONS = ('is_favorited', 'is_in_shopping_cart')
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit', 'amount')
+USER_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -31,14 +51,15 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
-class Base64ToFile(serializers.ImageField):
+class Base64ToFile(RecipeImageField):
     def to_internal_value(self, data):
-        format, datastr = data.split(';base64,')
-        ext = format.split('/')[-1]
-        if ext[:3] == 'svg':
-            ext = 'svg'
-        return ContentFile(
-            base64.b64decode(datastr), name='{}.{}'.format(uuid.uuid4(), ext))
+        return to_file(data, uuid.uuid4())
+
+    def get_variant(self):
+        view = self.context.get('view', None)
+        if view is not None and view.action in CARD_ACTIONS:
+            return CARD
+        return FULL
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
@@ -72,17 +93,21 @@ class RecipeSerializer(serializers.ModelSerializer):
         return value
 
     def get_ingredients(self, obj):
-        objects = RecipeIngredient.objects.filter(recipe=obj)
+        objects = obj.recipeingredient_set.all()
         serializer = IngredientInRecipeSerializer(objects, many=True)
         return serializer.data
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
+        if hasattr(obj, 'is_favorited'):
+            return user.is_authenticated and obj.is_favorited
         return user.is_authenticated and Favorite.objects.filter(
             recipe=obj, user=user).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return user.is_authenticated and obj.is_in_shopping_cart
         return user.is_authenticated and Cart.objects.filter(
             recipe=obj, user=user).exists()
 
@@ -90,21 +115,26 @@ class RecipeSerializer(serializers.ModelSerializer):
         ingredients_id = initial_data.pop('ingredients', None)
         if ingredients_id is None:
             raise serializers.ValidationError(INGREDIENS_KEY_ERROR)
-        ingredients = []
-        ids = set()
+        items = []
         for ingredient_id in ingredients_id:
             id = ingredient_id.get('id', None)
             amount = ingredient_id.get('amount', None)
             if id is None or amount is None:
                 raise serializers.ValidationError(INGREDIENT_NOT_CORRECT)
-            ingredient = Ingredient.objects.filter(id=id).first()
+            items.append((id, amount))
+        objects = Ingredient.objects.in_bulk(
+            {to_int(id) for id, amount in items} - {None})
+        ingredients = []
+        ids = set()
+        for id, amount in items:
+            ingredient = objects.get(to_int(id))
             if ingredient is None:
                 raise serializers.ValidationError(
                     INGREDIENT_NOT_FOUND.format(id))
-            if id in ids:
+            if ingredient.id in ids:
                 raise serializers.ValidationError(
                     SAME_INGREDIENT.format(ingredient.name))
-            ids.add(id)
+            ids.add(ingredient.id)
             try:
                 amount = int(amount)
             except ValueError:
@@ -117,51 +147,165 @@ class RecipeSerializer(serializers.ModelSerializer):
         return ingredients
 
     def list_tags(self, initial_data):
-        tags_id = self.initial_data.pop('tags', None)
+        tags_id = initial_data.pop('tags', None)
         if tags_id is None:
             raise serializers.ValidationError(TAGS_KEY_ERROR)
+        objects = Tag.objects.in_bulk(
+            {to_int(id) for id in tags_id} - {None})
         tags = []
         for id in tags_id:
-            tag = Tag.objects.filter(id=id).first()
+            tag = objects.get(to_int(id))
             if tag is None:
                 raise serializers.ValidationError(TAG_NOT_FOUND.format(id))
             tags.append(tag)
         return tags
 
+    def set_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к новому списку.
+
+        Удаляет, изменяет и добавляет только отличающиеся строки.
+        Удалённые строки вычитает из списков покупок сигнал post_delete.
+        """
+        old = {object.ingredient_id: object
+               for object in RecipeIngredient.objects.filter(recipe=recipe)}
+        new = {ingredient.id: amount for ingredient, amount in ingredients}
+        amounts = {id: amount - (old[id].amount if id in old else 0)
+                   for id, amount in new.items()}
+        RecipeIngredient.objects.filter(
+            recipe=recipe, ingredient_id__in=old.keys() - new.keys()).delete()
+        changed = []
+        for id in old.keys() & new.keys():
+            if old[id].amount != new[id]:
+                old[id].amount = new[id]
+                changed.append(old[id])
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(amount=amount, ingredient=ingredient,
+                             recipe=recipe)
+            for ingredient, amount in ingredients
+            if ingredient.id not in old)
+        CartIngredient.objects.change_recipe(recipe, amounts)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = self.list_ingredients(self.initial_data)
         tags = self.list_tags(self.initial_data)
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-        recipe.save()
-        for ingredient, amount in ingredients:
-            RecipeIngredient.objects.create(
-                amount=amount, ingredient=ingredient, recipe=recipe)
+        self.set_ingredients(recipe, ingredients)
+        schedule(recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = self.list_ingredients(self.initial_data)
         tags = self.list_tags(self.initial_data)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            release_on_commit(instance.image.name, instance.image.storage)
+            instance.image = validated_data['image']
+            instance.image_ready = False
+            schedule(instance.id)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
         instance.tags.set(tags)
         instance.save()
-        recipeingredients = get_list_or_404(RecipeIngredient, recipe=instance)
-        for object in recipeingredients:
-            object.delete()
-        for ingredient, amount in ingredients:
-            RecipeIngredient.objects.create(
-                amount=amount, ingredient=ingredient, recipe=instance)
+        self.set_ingredients(instance, ingredients)
         return instance
 
 
+def recipe_values(queryset):
+    """Строки рецептов для RecipeReader вместо объектов модели."""
+    annotations = [name for name in RECIPE_ANNOTATIONS
+                   if name in queryset.query.annotations]
+    return queryset.prefetch_related(None).values(
+        *RECIPE_VALUES, *annotations)
+
+
+class RecipeReader:
+    """Чтение рецептов без объектов моделей и полей DRF.
+
+    Отдаёт те же данные, что RecipeSerializer, по строкам recipe_values:
+    теги, ингредиенты и авторы всех рецептов читаются тремя запросами
+    через values_list.
+    """
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def data(self):
+        rows = list(self.instance) if self.many else [self.instance]
+        recipes = self.to_representation(rows)
+        return recipes if self.many else recipes[0]
+
+    def to_representation(self, rows):
+        user = self.context['request'].user
+        ids = [row['id'] for row in rows]
+        tags = defaultdict(list)
+        for recipe_id, *tag in Recipe.tags.through.objects.filter(
+                recipe_id__in=ids).order_by('tag_id').values_list(
+                    'recipe_id', 'tag__id', 'tag__name', 'tag__color',
+                    'tag__slug'):
+            tags[recipe_id].append(dict(zip(TAG_FIELDS, tag)))
+        ingredients = defaultdict(list)
+        for recipe_id, *ingredient in RecipeIngredient.objects.filter(
+                recipe_id__in=ids).order_by('id').values_list(
+                    'recipe_id', 'ingredient__id', 'ingredient__name',
+                    'ingredient__measurement_unit', 'amount'):
+            ingredients[recipe_id].append(
+                dict(zip(INGREDIENT_FIELDS, ingredient)))
+        authors = self.get_authors({row['author_id'] for row in rows}, user)
+        variant = self.get_variant()
+        storage = Recipe._meta.get_field('image').storage
+        return [{
+            'id': row['id'],
+            'tags': tags[row['id']],
+            'author': authors[row['author_id']],
+            'ingredients': ingredients[row['id']],
+            'is_favorited': (
+                user.is_authenticated and bool(row['is_favorited'])),
+            'is_in_shopping_cart': (
+                user.is_authenticated and bool(row['is_in_shopping_cart'])),
+            'name': row['name'],
+            'image': self.get_image(row, variant, storage),
+            'text': row['text'],
+            'cooking_time': row['cooking_time'],
+        } for row in rows]
+
+    def get_authors(self, ids, user):
+        authors = User.objects.filter(id__in=ids)
+        if not user.is_authenticated:
+            return {author['id']: dict(author, is_subscribed=False)
+                    for author in authors.values(*USER_FIELDS)}
+        authors = authors.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(author=OuterRef('pk'), user=user)))
+        return {author['id']: dict(
+            author, is_subscribed=bool(author['is_subscribed']))
+            for author in authors.values(*USER_FIELDS, 'is_subscribed')}
+
+    def get_image(self, row, variant, storage):
+        url = image_url(row['image'], storage,
+                        variant if row['image_ready'] else None)
+        if url is None:
+            return None
+        return self.context['request'].build_absolute_uri(url)
+
+    def get_variant(self):
+        view = self.context.get('view', None)
+        if view is not None and view.action in CARD_ACTIONS:
+            return CARD
+        return FULL
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = serializers.ImageField(source='recipe.image', read_only=True)
+    image = RecipeImageField(
+        source='recipe.image', variant=THUMBNAIL, read_only=True)
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
     class Meta:
@@ -172,9 +316,29 @@ class FavoriteSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='recipe.id')
     name = serializers.ReadOnlyField(source='recipe.name')
-    image = serializers.ImageField(source='recipe.image', read_only=True)
+    image = RecipeImageField(
+        source='recipe.image', variant=THUMBNAIL, read_only=True)
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time')
 
     class Meta:
         model = Cart
         fields = ('id', 'name', 'image', 'cooking_time')
+
+
+class BatchSerializer(serializers.Serializer):
+    """Список id для пакетных операций, повторы отбрасываются."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=BATCH_LIMIT)
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+def batch_result(id, status, data=None, errors=None):
+    result = {'id': id, 'status': status}
+    if data is not None:
+        result['data'] = data
+    if errors is not None:
+        result['errors'] = [errors]
+    return result
@@ -0,0 +1,132 @@
+import csv
+import hashlib
+import io
+import json
+from itertools import groupby
+
+from django.conf import settings
+from django.db.models import BigIntegerField, Count, F, Sum
+from django.db.models.functions import Cast
+from rest_framework.negotiation import DefaultContentNegotiation
+
+from .cache import INGREDIENTS, get_version
+
+CHUNK_SIZE = 2000
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 11
+PDF_MARGIN = 50
+PDF_LINE = 16
+
+
+class IgnoreFormatNegotiation(DefaultContentNegotiation):
+    """Не выбирает рендерер по параметру format.
+
+    Параметр format у списка покупок означает формат файла.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        return renderer, renderer.media_type
+
+
+def group_by_unit(rows):
+    return groupby(rows, key=lambda row: row['measurement_unit'])
+
+
+def write_txt(rows):
+    for unit, ingredients in group_by_unit(rows):
+        yield '{}:\n'.format(unit)
+        for ingredient in ingredients:
+            yield '{} - {} {}\n'.format(
+                ingredient['name'], ingredient['amount'], unit)
+        yield '\n'
+
+
+class Echo:
+    """Объект-файл для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def write_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('measurement_unit', 'name', 'amount'))
+    for row in rows:
+        yield writer.writerow(
+            (row['measurement_unit'], row['name'], row['amount']))
+
+
+def write_json(rows):
+    yield '['
+    for number, (unit, ingredients) in enumerate(group_by_unit(rows)):
+        yield '{}{{"measurement_unit": {}, "ingredients": ['.format(
+            ', ' if number else '', json.dumps(unit, ensure_ascii=False))
+        for index, ingredient in enumerate(ingredients):
+            yield '{}{}'.format(', ' if index else '', json.dumps(
+                {'name': ingredient['name'], 'amount': ingredient['amount']},
+                ensure_ascii=False))
+        yield ']}'
+    yield ']'
+
+
+def write_pdf(rows):
+    """PDF собирается в памяти целиком: reportlab пишет файл только в
+    save(). Строк в нём не больше, чем разных ингредиентов в списке, а
+    download_shopping_cart отказывает, если их больше
+    SHOPPING_CART_PDF_MAX_ROWS.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_CART_PDF_FONT))
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    for line in write_txt(rows):
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            y = height - PDF_MARGIN
+        pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+        pdf.drawString(PDF_MARGIN, y, line.rstrip('\n'))
+        y -= PDF_LINE
+    pdf.save()
+    buffer.seek(0)
+    return iter(lambda: buffer.read(CHUNK_SIZE * 32), b'')
+
+
+FORMATS = {
+    'txt': (write_txt, 'text/plain; charset=utf-8'),
+    'csv': (write_csv, 'text/csv; charset=utf-8'),
+    'json': (write_json, 'application/json'),
+    'pdf': (write_pdf, 'application/pdf'),
+}
+
+
+def cart_lines(cart):
+    """Строки файла списка покупок, сгруппированные по единицам."""
+    return cart.values(
+        'amount', name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit')).order_by(
+            'measurement_unit', 'name')
+
+
+def get_totals(cart):
+    """Итоги строк CartIngredient одним агрегатом, без чтения списка."""
+    return cart.aggregate(
+        rows=Count('id'), amount=Sum('amount'),
+        weighted=Sum(Cast('amount', BigIntegerField())
+                     * Cast('ingredient_id', BigIntegerField())))
+
+
+def get_etag(totals, format):
+    """Строгий ETag по итогам списка покупок, версии справочника
+    ингредиентов (названия и единицы входят в файл) и формату файла."""
+    key = '{}\0{}\0{rows}\0{amount}\0{weighted}'.format(
+        format, get_version(INGREDIENTS), **totals)
+    return '"{}"'.format(hashlib.sha256(key.encode()).hexdigest())
@@ -0,0 +1,121 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import User
+from .cache import (ALL, INGREDIENTS, LISTS, TAGS, bump_version,
+                    evict_lists_on_commit, evict_recipe_on_commit,
+                    touch_on_commit)
+from .images import release_on_commit
+from .models import (Cart, CartIngredient, Ingredient, Recipe,
+                     RecipeIngredient, Tag)
+
+# Поля пользователя, которых нет в рецептах.
+HIDDEN_USER_FIELDS = frozenset(('last_login', 'password'))
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_carts(sender, instance, **kwargs):
+    carts = Cart.objects.filter(recipe=instance)
+    CartIngredient.objects.remove_recipes(
+        carts.values_list('user_id', flat=True), (instance,))
+    # Ингредиенты рецепта удаляются следом и не должны вычитаться снова.
+    carts.delete()
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, **kwargs):
+    instance.saved_amount = RecipeIngredient.objects.filter(
+        pk=instance.pk).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def change_cart_ingredient(sender, instance, **kwargs):
+    """Изменения строк ингредиентов мимо RecipeSerializer, например в
+    админке, переносятся в списки покупок."""
+    amounts = {instance.ingredient_id: instance.amount}
+    if instance.saved_amount is not None:
+        id, amount = instance.saved_amount
+        amounts[id] = amounts.get(id, 0) - amount
+    CartIngredient.objects.change_recipe(instance.recipe_id, amounts)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_cart_ingredient(sender, instance, **kwargs):
+    CartIngredient.objects.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version(TAGS)
+    evict_lists_on_commit(ALL)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_version(INGREDIENTS)
+    evict_lists_on_commit(ALL)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(tags=instance).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(ingredients=instance).update(
+        modified=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    """Данные автора входят в рецепт, его рецепты считаются изменёнными."""
+    if created or (update_fields is not None
+                   and update_fields <= HIDDEN_USER_FIELDS):
+        return
+    Recipe.objects.filter(author=instance).update(modified=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def evict_saved_recipe(sender, instance, created, **kwargs):
+    if created:
+        evict_lists_on_commit(LISTS)
+    else:
+        evict_recipe_on_commit(instance.id)
+        # Рецепт мог выпасть из отфильтрованного списка.
+        touch_on_commit(LISTS)
+
+
+@receiver(post_delete, sender=Recipe)
+def evict_deleted_recipe(sender, instance, **kwargs):
+    evict_recipe_on_commit(instance.id)
+    evict_lists_on_commit(LISTS)
+    touch_on_commit(LISTS)
+    release_on_commit(instance.image.name, instance.image.storage)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def evict_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        tags = [instance]
+        recipes = pk_set
+        if recipes is None:
+            recipes = list(instance.recipes.values_list('id', flat=True))
+    else:
+        tags = instance.tags.all()
+        if pk_set is not None:
+            tags = Tag.objects.filter(id__in=pk_set)
+        recipes = [instance.id]
+    evict_lists_on_commit(*['tag:{}'.format(tag.slug) for tag in tags])
+    Recipe.objects.filter(id__in=recipes).update(modified=timezone.now())
+    for recipe_id in recipes:
+        evict_recipe_on_commit(recipe_id)
@@ -0,0 +1,43 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in iter(lambda: content.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class HashedImageStorage(FileSystemStorage):
+    """Хранит картинки под именем из хеша содержимого.
+
+    Одинаковые файлы записываются один раз: recipes/images/ab/abcd….jpg.
+    Повторная загрузка только обновляет время изменения файла, чтобы
+    сборщик мусора не удалил его до фиксации транзакции.
+    """
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        digest = content_hash(content)
+        name = os.path.join(directory, digest[:2], '{}{}'.format(
+            digest, os.path.splitext(filename)[1].lower()))
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+    def is_recent(self, name):
+        """Файл загружен недавно и может быть ещё не привязан к рецепту."""
+        age = time.time() - os.path.getmtime(self.path(name))
+        return age < settings.RECIPE_IMAGE_GC_GRACE
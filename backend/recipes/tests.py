@@ -0,0 +1,348 @@
+import threading
+from base64 import b64decode
+from collections import Counter
+from unittest import skipIf, skipUnless
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.cache import caches
+from django.db import connection, connections
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from users.models import Subscription, User
+from . import cache
+from .management.commands.check_query_plans import (get_queries,
+                                                    sequential_scans)
+from .models import (Cart, CartIngredient, Favorite, Ingredient, Recipe,
+                     RecipeIngredient, Tag)
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-responses',
+    },
+}
+PAGE_SIZES = (2, 6, 50)
+RECIPES = 60
+THREADS = 8
+
+
+def create_data():
+    """Авторы, теги, ингредиенты и RECIPES рецептов, читатель с
+    избранным, корзиной и подписками."""
+    # Справочники в памяти процесса помнят версию, а откат транзакции
+    # прошлого теста возвращает версии к тем же числам с другими id.
+    cache._tag_ids = cache._ingredient_ids = (None, {})
+    cache._responses.clear()
+    reader = User.objects.create_user(
+        username='reader', email='reader@example.com', password='password')
+    authors = [User.objects.create_user(
+        username='author{}'.format(number),
+        email='author{}@example.com'.format(number), password='password')
+        for number in range(3)]
+    tags = [Tag.objects.create(name='tag{}'.format(number),
+                               color='#00000{}'.format(number),
+                               slug='tag{}'.format(number))
+            for number in range(3)]
+    ingredients = [Ingredient.objects.create(
+        name='ingredient{}'.format(number), measurement_unit='г')
+        for number in range(5)]
+    for number in range(RECIPES):
+        recipe = Recipe.objects.create(
+            author=authors[number % len(authors)],
+            name='recipe{}'.format(number), text='text', cooking_time=5,
+            image='recipes/images/recipe.png')
+        recipe.tags.set(tags[:number % len(tags) + 1])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=number + 1)
+            for ingredient in ingredients[:number % 3 + 2])
+        if number % 2:
+            Favorite.objects.create(user=reader, recipe=recipe)
+            recipe.favorites_count = 1
+        if number % 3:
+            Cart.objects.create(user=reader, recipe=recipe)
+            recipe.in_carts_count = 1
+        recipe.save()
+    CartIngredient.objects.add_recipes(
+        (reader.id,), Recipe.objects.filter(shopping_cart__user=reader))
+    Subscription.objects.create(user=reader, author=authors[0])
+    return reader, authors
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeListQueriesTest(TestCase):
+    """Число запросов страницы рецептов не зависит от её размера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.authors = create_data()
+
+    def setUp(self):
+        caches['responses'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def assert_queries(self, number, url, **params):
+        # Первый запрос заполняет справочники в памяти процесса.
+        self.client.get(url, params)
+        for limit in PAGE_SIZES:
+            with self.subTest(url=url, limit=limit):
+                with self.assertNumQueries(number):
+                    response = self.client.get(
+                        url, dict(params, limit=limit))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), limit)
+
+    def subscribe_to_all(self):
+        Subscription.objects.bulk_create(
+            Subscription(user=self.reader, author=author)
+            for author in self.authors[1:])
+
+    def test_list(self):
+        self.assert_queries(6, '/api/recipes/')
+
+    def test_list_by_tags(self):
+        self.assert_queries(7, '/api/recipes/', tags=['tag0', 'tag1'])
+
+    def test_feed(self):
+        self.subscribe_to_all()
+        self.assert_queries(4, '/api/recipes/feed/')
+
+    @override_settings(RECIPE_FAST_READ=False)
+    def test_list_serializer(self):
+        self.assert_queries(6, '/api/recipes/')
+
+    @override_settings(RECIPE_FAST_READ=False)
+    def test_feed_serializer(self):
+        self.subscribe_to_all()
+        self.assert_queries(4, '/api/recipes/feed/')
+
+    def test_anonymous_list(self):
+        self.client.force_authenticate(None)
+        self.assert_queries(6, '/api/recipes/')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetPaginationTest(TestCase):
+    """Страницы ordering=popular по курсору без смещений."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.authors = create_data()
+
+    def test_popular_while_favorites_change(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        url = '/api/recipes/?ordering=popular&limit=7&cursor='
+        seen = []
+        changed = set()
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = [recipe['id'] for recipe in response.json()['results']]
+            seen.extend(page)
+            url = response.json()['next']
+            if url is None:
+                break
+            cursor = parse_qs(urlsplit(url).query)['cursor'][0]
+            self.assertNotIn('o', parse_qs(b64decode(cursor).decode()))
+            # Рецепты с этой и следующих страниц поднимаются выше.
+            unseen = Recipe.objects.exclude(id__in=seen).order_by('id')[0]
+            for recipe_id, change in ((page[0], 2), (unseen.id, 1)):
+                Recipe.objects.filter(id=recipe_id).update(
+                    favorites_count=F('favorites_count') + change)
+                changed.add(recipe_id)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(
+            set(Recipe.objects.values_list('id', flat=True)) - changed,
+            set(seen) - changed)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CartIngredientTest(TestCase):
+    """Итоги списков покупок совпадают с пересчитанными по корзинам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.authors = create_data()
+
+    def assert_totals(self):
+        self.assertEqual(
+            {(row.user_id, row.ingredient_id): row.amount
+             for row in CartIngredient.objects.all()},
+            {(user, ingredient): total for user, ingredient, total
+             in CartIngredient.objects.calculate()})
+
+    def test_update_ingredients(self):
+        recipe = Recipe.objects.get(name='recipe1')
+        self.assertTrue(recipe.shopping_cart.filter(user=self.reader))
+        kept, changed, removed = RecipeIngredient.objects.filter(
+            recipe=recipe).order_by('ingredient_id')
+        added = Ingredient.objects.exclude(recipes=recipe).first()
+        client = APIClient()
+        client.force_authenticate(recipe.author)
+        response = client.patch(
+            '/api/recipes/{}/'.format(recipe.id),
+            {'tags': [tag.id for tag in recipe.tags.all()],
+             'ingredients': [
+                 {'id': kept.ingredient_id, 'amount': kept.amount},
+                 {'id': changed.ingredient_id, 'amount': 10},
+                 {'id': added.id, 'amount': 3}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(RecipeIngredient.objects.filter(pk=removed.pk))
+        self.assert_totals()
+
+    def test_download_etag(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        url = '/api/recipes/download_shopping_cart/'
+        etag = client.get(url)['ETag']
+        self.assertEqual(
+            client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        recipe = Recipe.objects.exclude(shopping_cart__user=self.reader)[0]
+        client.post('/api/recipes/{}/shopping_cart/'.format(recipe.id))
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class AnonymousCacheTest(TestCase):
+    """Изменение рецепта удаляет его страницу из кеша анонимов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.authors = create_data()
+
+    def test_detail_key_ignores_leading_zeros(self):
+        recipe = Recipe.objects.first()
+        client = APIClient()
+        url = '/api/recipes/0{}/'.format(recipe.id)
+        self.assertEqual(client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(
+            client.get('/api/recipes/{}/'.format(recipe.id))['X-Cache'],
+            'HIT')
+        cache.evict_recipe(recipe.id)
+        self.assertEqual(client.get(url)['X-Cache'], 'MISS')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN только на PostgreSQL')
+class QueryPlansTest(TestCase):
+    """Частые запросы идут по индексам, а не полным просмотром."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.authors = create_data()
+
+    def test_no_sequential_scans(self):
+        with connection.cursor() as cursor:
+            # На маленьких таблицах планировщик выбрал бы Seq Scan и так.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        queries = get_queries(
+            self.reader, Recipe.objects.first(), Tag.objects.first())
+        for name, queryset in queries.items():
+            with self.subTest(query=name):
+                self.assertEqual(
+                    sequential_scans(queryset, queryset.explain()), [])
+
+
+@skipIf(connection.vendor == 'sqlite',
+        'SQLite в памяти не ждёт блокировок из других потоков')
+@override_settings(CACHES=TEST_CACHES)
+class ToggleRaceTest(TransactionTestCase):
+    """Из одновременных одинаковых запросов проходит ровно один."""
+
+    def setUp(self):
+        self.reader, self.authors = create_data()
+        self.user = User.objects.create_user(
+            username='racer', email='racer@example.com', password='password')
+        self.recipe = Recipe.objects.get(name='recipe0')
+
+    def race(self, requests):
+        """Отправляет запросы [(метод, url, данные)] одновременно.
+
+        Возвращает число ответов по статусам, для пакетных запросов -
+        по статусу их единственного результата.
+        """
+        barrier = threading.Barrier(len(requests))
+        statuses = Counter()
+        lock = threading.Lock()
+
+        def send(method, url, data):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                response = getattr(client, method)(url, data, format='json')
+                status = response.status_code
+                if status == 200:
+                    status = response.data['results'][0]['status']
+            except Exception as error:
+                status = repr(error)
+            finally:
+                connections.close_all()
+            with lock:
+                statuses[status] += 1
+
+        workers = [threading.Thread(target=send, args=request)
+                   for request in requests]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return statuses
+
+    def toggle(self, single, batch, id, check):
+        """Добавляет и удаляет связь одиночными и пакетными запросами
+        вперемешку, после каждого шага вызывает check(added)."""
+        for method, success in (('post', 201), ('delete', 204)):
+            with self.subTest(method=method):
+                statuses = self.race([
+                    (method, single, None) if number % 2
+                    else (method, batch, {'ids': [id]})
+                    for number in range(THREADS)])
+                self.assertEqual(statuses, {success: 1, 400: THREADS - 1})
+                check(method == 'post')
+
+    def check_counter(self, counter, related):
+        def check(added):
+            self.recipe.refresh_from_db()
+            self.assertEqual(getattr(self.recipe, counter), int(added))
+            self.assertEqual(getattr(self.recipe, related).count(),
+                             int(added))
+        return check
+
+    def test_favorite(self):
+        self.toggle('/api/recipes/{}/favorite/'.format(self.recipe.id),
+                    '/api/recipes/favorite/', self.recipe.id,
+                    self.check_counter('favorites_count', 'favorites'))
+
+    def test_shopping_cart(self):
+        check_counter = self.check_counter('in_carts_count', 'shopping_cart')
+
+        def check(added):
+            check_counter(added)
+            self.assertEqual(
+                {(row.user_id, row.ingredient_id): row.amount
+                 for row in CartIngredient.objects.all()},
+                {(user, ingredient): total for user, ingredient, total
+                 in CartIngredient.objects.calculate()})
+
+        self.toggle('/api/recipes/{}/shopping_cart/'.format(self.recipe.id),
+                    '/api/recipes/shopping_cart/', self.recipe.id, check)
+
+    def test_subscribe(self):
+        author = self.authors[0]
+
+        def check(added):
+            self.assertEqual(Subscription.objects.filter(
+                user=self.user, author=author).count(), int(added))
+
+        self.toggle('/api/users/{}/subscribe/'.format(author.id),
+                    '/api/users/subscribe/', author.id, check)
@@ -1,25 +1,53 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import zipfile
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, mixins, status, viewsets
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
-from .filters import RecipeFilter
-from .models import Cart, Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import Subscription, User, lock_users
+from users.pagination import KeysetPagination, LimitPagination
+from .bulk import RecipeImporter, export_recipes
+from .cache import (INGREDIENTS, POPULAR, TAGS, AnonymousCacheMixin,
+                    CachedReferenceMixin, ConditionalMixin,
+                    evict_lists_on_commit, touch_on_commit, user_key)
+from .filters import IngredientSearchFilter, RecipeFilter
+from .models import (Cart, CartIngredient, Favorite, FeedItem, Ingredient,
+                     Recipe, RecipeIngredient, Tag)
 from .permissions import IsAdminOrOwner
-from .serializers import (CartSerializer, FavoriteSerializer,
-                          IngredientSerializer, RecipeSerializer,
-                          TagSerializer)
+from .serializers import (BatchSerializer, CartSerializer,
+                          FavoriteSerializer, IngredientSerializer,
+                          RecipeReader, RecipeSerializer, TagSerializer,
+                          batch_result, recipe_values)
+from .shopping_cart import (CHUNK_SIZE, FORMATS, IgnoreFormatNegotiation,
+                            cart_lines, get_etag, get_totals)
 
 RECIPE_IN_FAVORITES = 'Рецепт уже есть в избранном'
 NOT_IN_FAVORITES = 'Рецепта нет в избранном'
 RECIPE_IN_CART = 'Рецепт уже есть в корзине'
 NOT_IN_CART = 'Рецепта нет в корзине'
+RECIPE_NOT_FOUND = 'Рецепт с id = {} не существует'
+WRONG_FORMAT = 'Формат {} не поддерживается'
+PDF_TOO_LARGE = ('В PDF помещается не больше {} ингредиентов, скачайте '
+                 'список в формате txt или csv')
+IMPORT_FILE_REQUIRED = 'Передайте файл NDJSON в поле file'
+WRONG_ARCHIVE = 'Поле images должно быть zip-архивом'
+READER_ACTIONS = ('list', 'retrieve', 'feed')
+
+
+def user_relations(model, user, ids):
+    """Строки избранного или корзины пользователя для рецептов ids."""
+    return model.objects.filter(user=user, recipe_id__in=ids)
 
 
 class ListRetrieve(mixins.ListModelMixin, mixins.RetrieveModelMixin,
@@ -28,73 +56,274 @@ class ListRetrieve(mixins.ListModelMixin, mixins.RetrieveModelMixin,
     pass
 
 
-class TagViewSet(ListRetrieve):
+class TagViewSet(CachedReferenceMixin, ListRetrieve):
+    reference_name = TAGS
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(ListRetrieve):
+class IngredientViewSet(CachedReferenceMixin, ListRetrieve):
+    reference_name = INGREDIENTS
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
+    filter_backends = (IngredientSearchFilter,)
+    pagination_class = LimitPagination
+
 
+class RecipeViewSet(ConditionalMixin, AnonymousCacheMixin,
+                    viewsets.ModelViewSet):
+    """Рецепты.
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    При RECIPE_FAST_READ list, retrieve и feed в JSON читают строки
+    values() и отдают их через RecipeReader вместо RecipeSerializer.
+    Объектные права IsAdminOrOwner на чтение не влияют, поэтому им
+    хватает словаря вместо объекта.
+    """
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthenticatedOrReadOnly, IsAdminOrOwner)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        user = self.request.user
+        authors = User.objects.all()
+        queryset = Recipe.objects.prefetch_related(
+            'tags', Prefetch('recipeingredient_set',
+                             queryset=RecipeIngredient.objects.select_related(
+                                 'ingredient').order_by('id')))
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(author=OuterRef('pk'), user=user)))
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    recipe=OuterRef('pk'), user=user)),
+                is_in_shopping_cart=Exists(Cart.objects.filter(
+                    recipe=OuterRef('pk'), user=user)))
+        return queryset.prefetch_related(Prefetch('author', queryset=authors))
+
+    @property
+    def fast_read(self):
+        # Формы браузерного API строятся сериализатором, им нужен DRF.
+        return (settings.RECIPE_FAST_READ and self.action in READER_ACTIONS
+                and self.request.accepted_renderer.format == 'json')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.fast_read:
+            return recipe_values(queryset)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.fast_read:
+            kwargs['context'] = self.get_serializer_context()
+            return RecipeReader(*args, **kwargs)
+        return super().get_serializer(*args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            recipe = serializer.save(author=self.request.user)
+            if FeedItem.objects.enabled():
+                FeedItem.objects.fan_out(recipe)
+
+    def get_feed_queryset(self):
+        queryset = self.get_queryset()
+        user = self.request.user
+        if FeedItem.objects.enabled():
+            return queryset.filter(feed_items__user=user)
+        return queryset.filter(author__following__user=user)
+
+    @action(detail=False, permission_classes=(IsAuthenticated,),
+            pagination_class=KeysetPagination)
+    def feed(self, request):
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_feed_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=('POST',), detail=False, url_path='import',
+            permission_classes=(IsAuthenticated,),
+            parser_classes=(MultiPartParser,))
+    def bulk_import(self, request):
+        file = request.FILES.get('file')
+        if file is None:
+            raise ValidationError(IMPORT_FILE_REQUIRED)
+        archive = request.FILES.get('images')
+        if archive is not None:
+            if not zipfile.is_zipfile(archive):
+                raise ValidationError(WRONG_ARCHIVE)
+            archive = zipfile.ZipFile(archive)
+        # Персонал может указать авторов в строках, остальные - только себя.
+        author = None if request.user.is_staff else request.user
+        report = RecipeImporter(author, archive).run(file)
+        return Response(report, status=(
+            status.HTTP_201_CREATED if report['created']
+            else status.HTTP_400_BAD_REQUEST))
+
+    @action(detail=False, url_path='export',
+            permission_classes=(IsAuthenticated,),
+            content_negotiation_class=IgnoreFormatNegotiation)
+    def bulk_export(self, request):
+        queryset = Recipe.objects.all()
+        if not request.user.is_staff:
+            queryset = queryset.filter(author=request.user)
+        response = StreamingHttpResponse(
+            export_recipes(self.filter_queryset(queryset)),
+            content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = (
+            'attachment; filename="recipes.ndjson"')
+        return response
+
+    def change_relations(self, user, model, counter, recipes, sign):
+        """Обновляет счётчики, итоги корзины и кеш после изменения связей.
+
+        recipes - id рецептов, добавленных (sign = 1) или удалённых
+        (sign = -1) из избранного или корзины пользователя.
+        """
+        if not recipes:
+            return
+        queryset = Recipe.objects.filter(id__in=recipes)
+        if sign < 0:
+            queryset = queryset.filter(**{counter + '__gt': 0})
+        queryset.update(**{counter: F(counter) + sign})
+        touch_on_commit(user_key(user.id))
+        if model is Favorite:
+            evict_lists_on_commit(POPULAR)
+            touch_on_commit(POPULAR)
+        if model is Cart:
+            if sign > 0:
+                CartIngredient.objects.add_recipes((user.id,), recipes)
+            else:
+                CartIngredient.objects.remove_recipes((user.id,), recipes)
 
     def favorite_or_cart(self, request, id, model, message_not_in, message_in,
-                         class_serializer):
+                         class_serializer, counter):
+        """Добавляет или удаляет рецепт без гонок между запросами.
+
+        Повторная вставка упирается в уникальное ограничение и превращается
+        в message_in, удаление проверяет число удалённых строк. Строка
+        пользователя блокируется, как в favorite_or_cart_batch.
+        """
         user = request.user
-        recipe = get_object_or_404(Recipe, id=id)
         if request.method == 'DELETE':
-            object = model.objects.filter(recipe=recipe, user=user).first()
-            if object is None:
+            with transaction.atomic():
+                lock_users((user.id,))
+                deleted, _ = user_relations(model, user, (id,)).delete()
+                self.change_relations(
+                    user, model, counter, (int(id),) if deleted else (), -1)
+            if not deleted:
+                get_object_or_404(Recipe, id=id)
                 raise ValidationError(message_not_in)
-            object.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
-        if model.objects.filter(recipe=recipe, user=user).exists():
-            raise ValidationError(message_in)
+        recipe = get_object_or_404(Recipe, id=id)
         serializer = class_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=user, recipe=recipe)
+        try:
+            with transaction.atomic():
+                lock_users((user.id,))
+                serializer.save(user=user, recipe=recipe)
+                self.change_relations(user, model, counter, (recipe.id,), 1)
+        except IntegrityError:
+            raise ValidationError(message_in)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def favorite_or_cart_batch(self, request, model, message_not_in,
+                               message_in, class_serializer, counter):
+        """Добавляет или удаляет список рецептов, результат по каждому id.
+
+        Связи пользователя читаются под блокировкой его строки, которую
+        берёт и favorite_or_cart, поэтому до конца транзакции их никто не
+        меняет и changed - ровно вставленные или удалённые строки.
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        recipes = Recipe.objects.in_bulk(ids)
+        results = {id: batch_result(id, status.HTTP_404_NOT_FOUND,
+                                    errors=RECIPE_NOT_FOUND.format(id))
+                   for id in ids if id not in recipes}
+        with transaction.atomic():
+            lock_users((user.id,))
+            existing = set(user_relations(model, user, recipes).values_list(
+                'recipe_id', flat=True))
+            if request.method == 'DELETE':
+                changed = [id for id in recipes if id in existing]
+                user_relations(model, user, changed).delete()
+                self.change_relations(user, model, counter, changed, -1)
+                for id in recipes:
+                    results[id] = (
+                        batch_result(id, status.HTTP_204_NO_CONTENT)
+                        if id in existing else batch_result(
+                            id, status.HTTP_400_BAD_REQUEST,
+                            errors=message_not_in))
+            else:
+                objects = model.objects.bulk_create(
+                    model(user=user, recipe=recipe)
+                    for id, recipe in recipes.items() if id not in existing)
+                self.change_relations(
+                    user, model, counter,
+                    [object.recipe_id for object in objects], 1)
+                for object in objects:
+                    results[object.recipe_id] = batch_result(
+                        object.recipe_id, status.HTTP_201_CREATED,
+                        data=class_serializer(object).data)
+                for id in existing:
+                    results[id] = batch_result(
+                        id, status.HTTP_400_BAD_REQUEST, errors=message_in)
+        return Response({'results': [results[id] for id in ids]})
+
     @action(methods=('POST', 'DELETE'), detail=False,
             url_path=r'(?P<id>\d+)/favorite',
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, id):
         return self.favorite_or_cart(request, id, Favorite, NOT_IN_FAVORITES,
-                                     RECIPE_IN_FAVORITES, FavoriteSerializer)
+                                     RECIPE_IN_FAVORITES, FavoriteSerializer,
+                                     'favorites_count')
+
+    @action(methods=('POST', 'DELETE'), detail=False,
+            url_path='favorite', permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        return self.favorite_or_cart_batch(
+            request, Favorite, NOT_IN_FAVORITES, RECIPE_IN_FAVORITES,
+            FavoriteSerializer, 'favorites_count')
 
     @action(methods=('POST', 'DELETE'), detail=False,
             url_path=r'(?P<id>\d+)/shopping_cart',
             permission_classes=(IsAuthenticated,))
     def shopping_cart(self, request, id):
         return self.favorite_or_cart(request, id, Cart, NOT_IN_CART,
-                                     RECIPE_IN_CART, CartSerializer)
+                                     RECIPE_IN_CART, CartSerializer,
+                                     'in_carts_count')
+
+    @action(methods=('POST', 'DELETE'), detail=False,
+            url_path='shopping_cart', permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        return self.favorite_or_cart_batch(
+            request, Cart, NOT_IN_CART, RECIPE_IN_CART, CartSerializer,
+            'in_carts_count')
 
-    @action(detail=False, permission_classes=(IsAuthenticated,))
+    @action(detail=False, permission_classes=(IsAuthenticated,),
+            content_negotiation_class=IgnoreFormatNegotiation)
     def download_shopping_cart(self, request):
-        cart = RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=request.user).values(
-                'ingredient__name', 'ingredient__measurement_unit').annotate(
-                    count=Sum('amount'))
-        response = HttpResponse(content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="cart.txt"'
-        for ingredient in cart:
-            row = '{} - {} {}\n'.format(
-                ingredient['ingredient__name'],
-                ingredient['count'],
-                ingredient['ingredient__measurement_unit'])
-            response.write(row)
+        format = request.query_params.get('format', 'txt')
+        if format not in FORMATS:
+            raise ValidationError(WRONG_FORMAT.format(format))
+        writer, content_type = FORMATS[format]
+        cart = CartIngredient.objects.filter(user=request.user)
+        totals = get_totals(cart)
+        limit = settings.SHOPPING_CART_PDF_MAX_ROWS
+        if format == 'pdf' and totals['rows'] > limit:
+            raise ValidationError(PDF_TOO_LARGE.format(limit))
+        etag = get_etag(totals, format)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = StreamingHttpResponse(
+                writer(cart_lines(cart).iterator(chunk_size=CHUNK_SIZE)),
+                content_type=content_type)
+            response['Content-Disposition'] = (
+                'attachment; filename="cart.{}"'.format(format))
+        response['ETag'] = etag
         return response
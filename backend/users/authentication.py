@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+HIT = 'hit'
+MISS = 'miss'
+SHARED_HIT = 'shared_hit'
+STATS = (HIT, SHARED_HIT, MISS)
+# Счётчики копятся в процессе и сбрасываются в общий кеш пачками.
+FLUSH_EVERY = 100
+
+_tokens = OrderedDict()
+_lock = threading.Lock()
+_pending = dict.fromkeys(STATS, 0)
+
+
+def cache_key(key):
+    # В общем кеше хранится не сам токен, а его хеш.
+    return 'auth:token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def get_shared_cache():
+    alias = settings.TOKEN_CACHE_BACKEND
+    return caches[alias] if alias else None
+
+
+def get_stats_cache():
+    return caches[settings.TOKEN_CACHE_BACKEND or settings.RECIPES_CACHE]
+
+
+def count(name):
+    with _lock:
+        _pending[name] += 1
+        if sum(_pending.values()) < FLUSH_EVERY:
+            return
+        pending = dict(_pending)
+        for stat in STATS:
+            _pending[stat] = 0
+    flush(pending)
+
+
+def flush(pending):
+    cache = get_stats_cache()
+    for name, value in pending.items():
+        key = 'auth:stats:{}'.format(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.set(key, value, None)
+
+
+def get_stats():
+    """Попадания и промахи кеша токенов во всех процессах.
+
+    Последние FLUSH_EVERY запросов каждого процесса могут быть не учтены.
+    """
+    cache = get_stats_cache()
+    return {name: cache.get('auth:stats:{}'.format(name), 0)
+            for name in STATS}
+
+
+def invalidate(*keys):
+    """Забывает токены в этом процессе и в общем кеше."""
+    with _lock:
+        for key in keys:
+            _tokens.pop(key, None)
+    shared = get_shared_cache()
+    if shared is not None and keys:
+        shared.delete_many([cache_key(key) for key in keys])
+
+
+def invalidate_user(user_id):
+    with _lock:
+        keys = [key for key, (user, expires) in _tokens.items()
+                if user.id == user_id]
+    invalidate(*keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кешем токен -> пользователь.
+
+    В процессе хранится LRU на TOKEN_CACHE_SIZE токенов, каждый живёт
+    TOKEN_CACHE_TTL секунд. Если задан TOKEN_CACHE_BACKEND, промахи
+    сначала ищутся в общем кеше. Записи сбрасываются сигналами при
+    удалении токена и сохранении пользователя; в других процессах без
+    общего кеша запись доживает до конца TOKEN_CACHE_TTL.
+    """
+
+    def authenticate_credentials(self, key):
+        user = self.get_cached(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            self.remember(key, user)
+            return user, token
+        if not user.is_active:
+            invalidate(key)
+            return super().authenticate_credentials(key)
+        return user, self.get_model()(key=key, user=user)
+
+    def get_cached(self, key):
+        now = time.monotonic()
+        with _lock:
+            user, expires = _tokens.get(key, (None, 0))
+            if expires > now:
+                _tokens.move_to_end(key)
+            else:
+                user = None
+                _tokens.pop(key, None)
+        if user is not None:
+            count(HIT)
+            return user
+        shared = get_shared_cache()
+        if shared is not None:
+            user = shared.get(cache_key(key))
+            if user is not None:
+                count(SHARED_HIT)
+                self.remember(key, user, shared=False)
+                return user
+        count(MISS)
+        return None
+
+    def remember(self, key, user, shared=True):
+        ttl = settings.TOKEN_CACHE_TTL
+        with _lock:
+            _tokens[key] = (user, time.monotonic() + ttl)
+            _tokens.move_to_end(key)
+            while len(_tokens) > settings.TOKEN_CACHE_SIZE:
+                _tokens.popitem(last=False)
+        cache = get_shared_cache()
+        if shared and cache is not None:
+            cache.set(cache_key(key), user, ttl)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.authentication import HIT, MISS, SHARED_HIT, get_stats
+
+STATS = ('Попаданий: {} (в процессе {}, в общем кеше {}), промахов: {}, '
+         'доля попаданий: {:.1%}')
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кеша токенов авторизации'
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        hits = stats[HIT] + stats[SHARED_HIT]
+        total = hits + stats[MISS]
+        self.stdout.write(STATS.format(
+            hits, stats[HIT], stats[SHARED_HIT], stats[MISS],
+            hits / total if total else 0))
@@ -7,6 +7,7 @@ class User(AbstractUser):
     username = models.CharField('Логин', unique=True, max_length=150)
     first_name = models.CharField('Имя', max_length=150)
     last_name = models.CharField('Фамилия', max_length=150)
+    modified = models.DateTimeField('Изменён', auto_now=True)
 
     class Meta:
         ordering = ['id']
@@ -14,6 +15,16 @@ class User(AbstractUser):
         verbose_name_plural = 'Пользователи'
 
 
+def lock_users(ids):
+    """Блокирует строки пользователей до конца транзакции.
+
+    Блокировки берутся по порядку id, чтобы параллельные транзакции не
+    ждали друг друга по кругу.
+    """
+    return list(User.objects.select_for_update().filter(
+        id__in=ids).order_by('id').values_list('id', flat=True))
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='follower')
@@ -24,3 +35,5 @@ class Subscription(models.Model):
         constraints = [models.UniqueConstraint(
             fields=['user', 'author'], name='unique_subscribe')
         ]
+        indexes = [models.Index(fields=['author', 'user'],
+                                name='subscription_author_user_idx')]
@@ -1,5 +1,183 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+COUNT_QUERY_PARAM = 'count'
+EXACT = 'exact'
+APPROXIMATE = 'approximate'
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL без COUNT(*)."""
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class KeysetPagination(CursorPagination):
+    """Страницы по ключу: WHERE (поля сортировки) после последней строки
+    вместо OFFSET.
+
+    Порядок берётся из явной сортировки queryset (например,
+    ordering=popular) или из cursor_ordering представления,
+    по умолчанию -id. Если последнее поле не id, к нему добавляется -id.
+    Позиция в курсоре хранит значения всех полей сортировки и уникальна,
+    поэтому страницы не переходят на смещения при одинаковых значениях,
+    а строки, которые не менялись, не теряются и не повторяются, пока
+    меняются счётчики других.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = '-id'
+    encoder = JSONEncoder
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(queryset.query.order_by) or (
+            getattr(view, 'cursor_ordering', self.ordering),)
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering += ('-id',)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        count = request.query_params.get(COUNT_QUERY_PARAM)
+        if count == EXACT:
+            self.count = queryset.count()
+        elif count == APPROXIMATE:
+            self.count = estimate_count(queryset)
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(field[1:] if field.startswith('-')
+                             else '-' + field for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = None
+        if len(results) > len(self.page):
+            following = self._get_position_from_instance(
+                results[-1], self.ordering)
+        started = position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = started, following is not None
+            self.next_position, self.previous_position = position, following
+        else:
+            self.has_next, self.has_previous = following is not None, started
+            self.next_position, self.previous_position = following, position
+        self.display_page_controls = self.has_previous or self.has_next
+        return self.page
+
+    def after(self, ordering, position):
+        """Условие «строка дальше позиции» по всем полям сортировки."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            condition |= equal & Q(**{name + lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        get = instance.get if isinstance(instance, dict) else (
+            lambda name: getattr(instance, name))
+        return json.dumps([get(field.lstrip('-')) for field in ordering],
+                          cls=self.encoder)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+            response.data.move_to_end('count', last=False)
+        return response
 
 
 class QueryPageSizePagination(PageNumberPagination):
+    """Постраничный вывод с параметром limit.
+
+    С параметром cursor включается KeysetPagination. Параметр
+    count=approximate заменяет COUNT(*) оценкой планировщика.
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.django_paginator_class = Paginator
+        if request.query_params.get(COUNT_QUERY_PARAM) == APPROXIMATE:
+            self.django_paginator_class = ApproximateCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class LimitPagination(BasePagination):
+    """Первые limit объектов без подсчёта общего количества.
+
+    При поиске по названию limit по умолчанию равен
+    INGREDIENT_SEARCH_LIMIT.
+    """
+    limit_query_param = 'limit'
+
+    def get_limit(self, request):
+        default = None
+        if request.query_params.get(api_settings.SEARCH_PARAM):
+            default = settings.INGREDIENT_SEARCH_LIMIT
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return default
+        if limit <= 0:
+            return default
+        return min(limit, settings.INGREDIENT_SEARCH_MAX_LIMIT)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        if limit is None:
+            return None
+        return list(queryset[:limit])
+
+    def get_paginated_response(self, data):
+        return Response(data)
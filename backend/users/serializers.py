@@ -1,10 +1,19 @@
 from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers
 
+from recipes.images import THUMBNAIL, RecipeImageField
 from recipes.models import Recipe
 from .models import Subscription, User
 
 
+def get_recipes_limit(request):
+    try:
+        limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
 class CreateUserSerializer(UserCreateSerializer):
     class Meta:
         model = User
@@ -22,6 +31,8 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
+        if hasattr(obj, 'is_subscribed'):
+            return user.is_authenticated and obj.is_subscribed
         return user.is_authenticated and Subscription.objects.filter(
             author=obj, user=user).exists()
 
@@ -29,7 +40,7 @@ class UserSerializer(serializers.ModelSerializer):
 class CompactRecipeSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
     name = serializers.ReadOnlyField()
-    image = serializers.ImageField(read_only=True)
+    image = RecipeImageField(variant=THUMBNAIL, read_only=True)
     cooking_time = serializers.ReadOnlyField()
 
     class Meta:
@@ -54,16 +65,19 @@ class SubscribeSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         user = self.context.get('request').user
+        if obj.user_id == user.id:
+            return True
         return user.is_authenticated and Subscription.objects.filter(
             author=obj.author, user=user).exists()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit', None)
-        queryset = Recipe.objects.filter(author=obj.author)
-        if limit:
-            queryset = queryset[:int(limit)]
+        queryset = getattr(obj.author, 'page_recipes', None)
+        if queryset is None:
+            limit = get_recipes_limit(self.context.get('request'))
+            queryset = Recipe.objects.filter(author=obj.author)[:limit]
         return CompactRecipeSerializer(queryset, many=True).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.author.recipes.count()
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import get_shared_cache, invalidate, invalidate_user
+from .models import User
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields, **kwargs):
+    """Сбрасывает кеш токенов после смены пароля, блокировки и т. п."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    invalidate_user(instance.id)
+    if get_shared_cache() is not None:
+        invalidate(*Token.objects.filter(user=instance).values_list(
+            'key', flat=True))
@@ -1,3 +1,7 @@
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
 from djoser.serializers import SetPasswordSerializer
 from rest_framework import mixins, status, viewsets
@@ -6,13 +10,22 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 
-from .models import Subscription, User
+from recipes.cache import conditional_response, touch_on_commit, user_key
+from recipes.models import FeedItem, Recipe
+from recipes.serializers import BatchSerializer, batch_result
+from .models import Subscription, User, lock_users
 from .serializers import (CreateUserSerializer, SubscribeSerializer,
-                          UserSerializer)
+                          UserSerializer, get_recipes_limit)
 
 SUBSCRIBE_EXIST = 'Вы уже подписаны на данного автора'
 SUBSCRIBE_NOT_EXIST = 'Вы не подписаны на данного автора'
 SUBSCRIBE_TO_MYSELF = 'Нельзя подписать на самого себя'
+USER_NOT_FOUND = 'Пользователь с id = {} не существует'
+
+
+def user_subscriptions(user, ids):
+    """Подписки пользователя на авторов ids."""
+    return Subscription.objects.filter(user=user, author_id__in=ids)
 
 
 class CreateListRetrieve(mixins.CreateModelMixin, mixins.ListModelMixin,
@@ -25,6 +38,7 @@ class UserViewSet(CreateListRetrieve):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (IsAuthenticated,)
+    cursor_ordering = 'id'
 
     def get_permissions(self):
         if self.action == 'create' or self.action == 'list':
@@ -36,53 +50,137 @@ class UserViewSet(CreateListRetrieve):
             return CreateUserSerializer
         if self.action == 'set_password':
             return SetPasswordSerializer
-        if self.action == 'subscribe' or self.action == 'subscriptions':
+        if self.action in ('subscribe', 'subscribe_batch', 'subscriptions'):
             return SubscribeSerializer
         return UserSerializer
 
     @action(detail=False)
     def me(self, request):
         user = get_object_or_404(User, username=request.user.username)
-        serializer = self.get_serializer(user)
-        return Response(serializer.data)
+        key = '{}|{}|{}'.format(
+            user.id, user.modified.isoformat(), request.accepted_media_type)
+        etag = '"{}"'.format(hashlib.sha1(key.encode()).hexdigest()[:16])
+        return conditional_response(
+            request, etag, user.modified,
+            lambda: Response(self.get_serializer(user).data))
 
     @action(methods=('POST',), detail=False)
     def set_password(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.request.user.set_password(
-            serializer.validated_data['new_password'])
-        self.request.user.save()
+        # request.user может быть из кеша токенов, его save() вернул бы
+        # устаревшие поля. Кеш сбросит сигнал сохранения пользователя.
+        user = User.objects.get(pk=request.user.pk)
+        user.set_password(serializer.validated_data['new_password'])
+        user.save(update_fields=('password',))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=('POST', 'DELETE'), detail=False,
             url_path=r'(?P<id>\d+)/subscribe')
     def subscribe(self, request, id):
         user = request.user
-        author = get_object_or_404(User, id=id)
-        if user == author:
+        if int(id) == user.id:
             raise ValidationError(SUBSCRIBE_TO_MYSELF)
         if request.method == 'DELETE':
-            object = Subscription.objects.filter(
-                author=author, user=user).first()
-            if object is None:
+            with transaction.atomic():
+                lock_users((user.id,))
+                deleted, _ = user_subscriptions(user, (id,)).delete()
+                if deleted:
+                    touch_on_commit(user_key(user.id))
+                if deleted and FeedItem.objects.enabled():
+                    FeedItem.objects.unsubscribe(user, (id,))
+            if not deleted:
+                get_object_or_404(User, id=id)
                 raise ValidationError(SUBSCRIBE_NOT_EXIST)
-            object.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
-        if Subscription.objects.filter(author=author, user=user).exists():
-            raise ValidationError(SUBSCRIBE_EXIST)
+        author = get_object_or_404(User, id=id)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=user, author=author)
+        try:
+            with transaction.atomic():
+                lock_users((user.id,))
+                serializer.save(user=user, author=author)
+                touch_on_commit(user_key(user.id))
+                if FeedItem.objects.enabled():
+                    FeedItem.objects.subscribe(user, (author,))
+        except IntegrityError:
+            raise ValidationError(SUBSCRIBE_EXIST)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False)
+    @action(methods=('POST', 'DELETE'), detail=False,
+            url_path='subscribe')
+    def subscribe_batch(self, request):
+        """Подписывает на список авторов или отписывает от них.
+
+        Подписки читаются под блокировкой строки пользователя, как в
+        favorite_or_cart_batch.
+        """
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        user = request.user
+        authors = set(User.objects.filter(id__in=ids).values_list(
+            'id', flat=True))
+        results = {id: batch_result(id, status.HTTP_404_NOT_FOUND,
+                                    errors=USER_NOT_FOUND.format(id))
+                   for id in ids if id not in authors}
+        if user.id in authors:
+            authors.remove(user.id)
+            results[user.id] = batch_result(
+                user.id, status.HTTP_400_BAD_REQUEST,
+                errors=SUBSCRIBE_TO_MYSELF)
+        with transaction.atomic():
+            lock_users((user.id,))
+            existing = set(user_subscriptions(user, authors).values_list(
+                'author_id', flat=True))
+            touch_on_commit(user_key(user.id))
+            if request.method == 'DELETE':
+                changed = authors & existing
+                user_subscriptions(user, changed).delete()
+                if FeedItem.objects.enabled():
+                    FeedItem.objects.unsubscribe(user, changed)
+                for id in authors:
+                    results[id] = (
+                        batch_result(id, status.HTTP_204_NO_CONTENT)
+                        if id in existing else batch_result(
+                            id, status.HTTP_400_BAD_REQUEST,
+                            errors=SUBSCRIBE_NOT_EXIST))
+            else:
+                changed = authors - existing
+                Subscription.objects.bulk_create(
+                    Subscription(user=user, author_id=id) for id in changed)
+                if FeedItem.objects.enabled():
+                    FeedItem.objects.subscribe(user, changed)
+                serializer = self.get_serializer(
+                    self.get_subscriptions(request).filter(
+                        author_id__in=changed), many=True)
+                for data in serializer.data:
+                    results[data['id']] = batch_result(
+                        data['id'], status.HTTP_201_CREATED, data=data)
+                for id in authors & existing:
+                    results[id] = batch_result(
+                        id, status.HTTP_400_BAD_REQUEST,
+                        errors=SUBSCRIBE_EXIST)
+        return Response({'results': [results[id] for id in ids]})
+
+    def get_subscriptions(self, request):
+        """Подписки пользователя с рецептами авторов в один запрос."""
+        recipes = Recipe.objects.all()
+        limit = get_recipes_limit(request)
+        if limit is not None:
+            recipes = recipes.filter(id__in=Subquery(Recipe.objects.filter(
+                author=OuterRef('author')).values('id')[:limit]))
+        return Subscription.objects.filter(
+            user=request.user).select_related('author').annotate(
+                recipes_count=Count('author__recipes')).prefetch_related(
+                    Prefetch('author__recipes', queryset=recipes,
+                             to_attr='page_recipes')).order_by('-id')
+
+    @action(detail=False, cursor_ordering='-id')
     def subscriptions(self, request):
-        objects = Subscription.objects.filter(user=request.user)
-        if not objects:
-            return Response(status=status.HTTP_200_OK)
+        objects = self.get_subscriptions(request)
         page = self.paginate_queryset(objects)
-        if page:
+        if page is not None:
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(objects, many=True)